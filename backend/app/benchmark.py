@@ -0,0 +1,364 @@
+"""
+Upload pipeline benchmarks
+Run from backend/app, each measurement runs in a fresh process against a throwaway SQLite file:
+
+    python benchmark.py upload-memory --rows 10000 100000 1000000
+    python benchmark.py insert --rows 100000 [--database-url postgresql://...]
+    python benchmark.py upload-formats --rows 100000
+    python benchmark.py analytics --rows 100000 [--database-url postgresql://...]
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+CSV_HEADER = ['id', 'age', 'days_lps', 'employed', 'benefits', 'driver', 'vdu',
+              'varifocal', 'high_rx', 'appointment_date']
+
+
+def write_appointments_csv(path, rows, past=False, seed=42):
+    #random appointments in the upload schema, written row by row
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 6, 9, 0)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER + (['amount_spent'] if past else []))
+        for i in range(rows):
+            row = [100000 + i, rng.randint(18, 85), rng.randint(30, 1460)]
+            row += [rng.choice('YN') for _ in range(6)]
+            row.append((start + timedelta(minutes=15 * i)).isoformat(sep=' '))
+            if past:
+                row.append(round(rng.uniform(0, 300), 2))
+            writer.writerow(row)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # linux reports KB
+
+
+def run_upload_memory(rows, past, upsert=False):
+    #child process: one upload of `rows` rows, prints a json result line
+    #upsert stores the file first, then measures syncing the same file against that history
+    import main
+    from database import SessionLocal, User, create_tables
+    from uploads import ingest_past, ingest_upcoming, sync_past, sync_upcoming
+
+    workdir = tempfile.mkdtemp()
+    csv_path = os.path.join(workdir, 'upload.csv')
+    write_appointments_csv(csv_path, rows, past)
+
+    create_tables()
+    main.load_models()
+    db = SessionLocal()
+    user = User(username='bench', email='bench@example.com', hashed_password='x', practice_name='bench')
+    db.add(user)
+    db.commit()
+
+    ingest = ingest_past if past else ingest_upcoming
+    if upsert:
+        with open(csv_path, 'rb') as stream:
+            ingest(db, user.id, stream, main.predict_for_patients)
+        db.commit()
+        ingest = lambda *args: sum((sync_past if past else sync_upcoming)(*args).values())
+
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    with open(csv_path, 'rb') as stream:
+        count = ingest(db, user.id, stream, main.predict_for_patients)
+    db.commit()
+    elapsed = time.perf_counter() - started
+    db.close()
+
+    print(json.dumps({
+        'rows': count,
+        'file_mb': round(os.path.getsize(csv_path) / 1e6, 1),
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(count / elapsed),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+
+
+def upload_memory(args):
+    for rows in args.rows:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{tempfile.mktemp(suffix='.db')}")
+        command = ([sys.executable, __file__, '_upload-memory-child', str(rows)]
+                   + (['--past'] if args.past else []) + (['--upsert'] if args.upsert else []))
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        print(output.strip().splitlines()[-1])
+
+
+def run_insert(rows):
+    #child process: same patient + prediction rows through the ORM and through insert_rows
+    from database import Patient, Prediction, SessionLocal, User, create_tables, insert_rows
+
+    create_tables()
+    db = SessionLocal()
+    user = User(username='bench', email='bench@example.com', hashed_password='x', practice_name='bench')
+    db.add(user)
+    db.commit()
+
+    rng = random.Random(42)
+    start = datetime(2025, 1, 6, 9, 0)
+    records = [
+        {'user_id': user.id, 'patient_id': 100000 + i, 'age': rng.randint(18, 85),
+         'days_lps': rng.randint(30, 1460), 'appointment_date': start + timedelta(minutes=15 * i),
+         **{name: rng.random() < 0.5 for name in ('employed', 'benefits', 'driver', 'vdu', 'varifocal', 'high_rx')}}
+        for i in range(rows)
+    ]
+    scores = [(rng.random(), rng.uniform(0, 300)) for _ in range(rows)]
+
+    def orm():
+        patients = [Patient(**record) for record in records]
+        db.add_all(patients)
+        db.flush()
+        db.add_all([Prediction(patient_id=patient.id, purchase_probability=p, predicted_spend=s)
+                    for patient, (p, s) in zip(patients, scores)])
+        db.flush()
+
+    def bulk():
+        patient_ids = insert_rows(db, Patient, records, return_ids=True)
+        insert_rows(db, Prediction, [
+            {'patient_id': patient_id, 'purchase_probability': p, 'predicted_spend': s}
+            for patient_id, (p, s) in zip(patient_ids, scores)
+        ])
+
+    result = {'backend': db.get_bind().dialect.name, 'rows': rows}
+    for name, insert in (('orm', orm), ('insert_rows', bulk)):
+        started = time.perf_counter()
+        insert()
+        db.commit()
+        result[f'{name}_seconds'] = round(time.perf_counter() - started, 2)
+        db.expunge_all()
+    result['speedup'] = round(result['orm_seconds'] / result['insert_rows_seconds'], 1)
+    db.close()
+
+    print(json.dumps(result))
+
+
+def insert(args):
+    for rows in args.rows:
+        url = args.database_url or f"sqlite:///{tempfile.mktemp(suffix='.db')}"
+        env = dict(os.environ, DATABASE_URL=url)
+        command = [sys.executable, __file__, '_insert-child', str(rows)]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        print(output.strip().splitlines()[-1])
+
+
+def write_upload_formats(workdir, rows, past=False):
+    #the same appointments as plain, gzip and zstd csv plus typed parquet and arrow ipc
+    import gzip
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as parquet
+    import zstandard
+
+    csv_path = os.path.join(workdir, 'upload.csv')
+    write_appointments_csv(csv_path, rows, past)
+    with open(csv_path, 'rb') as f:
+        raw = f.read()
+
+    paths = {'csv': csv_path}
+    paths['csv.gz'] = csv_path + '.gz'
+    with open(paths['csv.gz'], 'wb') as f:
+        f.write(gzip.compress(raw, compresslevel=6))
+    paths['csv.zst'] = csv_path + '.zst'
+    with open(paths['csv.zst'], 'wb') as f:
+        f.write(zstandard.ZstdCompressor(level=3).compress(raw))
+
+    frame = pd.read_csv(csv_path, parse_dates=['appointment_date'])
+    for column in ('employed', 'benefits', 'driver', 'vdu', 'varifocal', 'high_rx'):
+        frame[column] = frame[column] == 'Y'
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    paths['parquet'] = os.path.join(workdir, 'upload.parquet')
+    parquet.write_table(table, paths['parquet'], compression='zstd')
+    paths['arrow'] = os.path.join(workdir, 'upload.arrow')
+    feather.write_feather(table, paths['arrow'], compression='zstd')
+    return paths
+
+
+def run_upload_formats(rows, past):
+    #child process: ingest the same upload in every format, replacing the previous one each time
+    import main
+    from database import SessionLocal, User, create_tables
+    from schemas import PastAppointmentCSV, UpcomingAppointmentCSV
+    from uploads import column_features, read_upload_columns
+
+    workdir = tempfile.mkdtemp()
+    paths = write_upload_formats(workdir, rows, past)
+
+    create_tables()
+    main.load_models()
+    db = SessionLocal()
+    schema = PastAppointmentCSV if past else UpcomingAppointmentCSV
+    process = main.process_past if past else main.process_upcoming
+    results = []
+    for fmt, path in paths.items():
+        # parse + decode only
+        started = time.perf_counter()
+        with open(path, 'rb') as stream:
+            for columns in read_upload_columns(stream, schema, fmt=fmt):
+                column_features(columns)
+        parse_seconds = time.perf_counter() - started
+
+        # a fresh user per format so every run inserts into the same amount of data
+        user = User(username=f'bench-{fmt}', email=f'{fmt}@example.com', hashed_password='x', practice_name='bench')
+        db.add(user)
+        db.commit()
+        started = time.perf_counter()
+        with open(path, 'rb') as stream:
+            process(db, user.id, stream, 'replace', fmt=fmt)
+        db.commit()
+        elapsed = time.perf_counter() - started
+        results.append({'format': fmt, 'bytes': os.path.getsize(path), 'parse_seconds': round(parse_seconds, 3),
+                        'seconds': round(elapsed, 2)})
+
+    base = results[0]
+    for result in results:
+        result['size_vs_csv'] = round(result['bytes'] / base['bytes'], 3)
+        result['time_vs_csv'] = round(result['seconds'] / base['seconds'], 2)
+    db.close()
+
+    print(json.dumps(results))
+
+
+def upload_formats(args):
+    for rows in args.rows:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{tempfile.mktemp(suffix='.db')}")
+        command = [sys.executable, __file__, '_upload-formats-child', str(rows)] + (['--past'] if args.past else [])
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        print(f"{rows} rows")
+        for result in json.loads(output.strip().splitlines()[-1]):
+            print(f"  {result['format']:8} {result['bytes']:>11,} bytes ({result['size_vs_csv']:.3f}x)"
+                  f"  parse {result['parse_seconds']:.3f}s  end-to-end {result['seconds']:6.2f}s ({result['time_vs_csv']:.2f}x)")
+
+
+def run_analytics(rows, repeat=5):
+    #child process: `rows` upcoming + `rows` past appointments for one user, then time the analytics endpoints
+    import statistics
+    from sqlalchemy import event
+
+    import main
+    from database import Past, SessionLocal, User, create_tables, engine
+    from uploads import ingest_past, ingest_upcoming
+
+    workdir = tempfile.mkdtemp()
+    paths = {}
+    for kind in ('upcoming', 'past'):
+        paths[kind] = os.path.join(workdir, f'{kind}.csv')
+        write_appointments_csv(paths[kind], rows, past=kind == 'past')
+
+    create_tables()
+    main.load_models()
+    db = SessionLocal()
+    user = User(username='bench', email='bench@example.com', hashed_password='x', practice_name='bench')
+    db.add(user)
+    db.commit()
+    for kind, ingest in (('upcoming', ingest_upcoming), ('past', ingest_past)):
+        with open(paths[kind], 'rb') as stream:
+            ingest(db, user.id, stream, main.predict_for_patients)
+    db.commit()
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    # keyset cursor one page before the end of the past history
+    end = db.query(Past.appointment_date, Past.id).filter(Past.user_id == user.id).order_by(
+        Past.appointment_date.desc(), Past.id.desc()).offset(main.PAST_PAGE_SIZE).first()
+    all_fields = list(main.PAST_COLUMNS)
+
+    # the generated appointments start on 2025-01-06, 96 per day
+    # plain queries first, then the endpoints - those are response cache hits after the warm up call
+    calls = {
+        'weekly': lambda: main.weekly_totals(db, user.id, date(2025, 3, 3)),
+        'monthly': lambda: main.monthly_totals(db, user.id, '2025-03', date(2025, 3, 1), date(2025, 4, 1)),
+        'past_first_page': lambda: main.past_page(db, user.id, None, main.PAST_PAGE_SIZE, all_fields),
+        'past_last_page': lambda: main.past_page(db, user.id, tuple(end), main.PAST_PAGE_SIZE, all_fields),
+        'weekly_cached': lambda: main.get_weekly_forecast('2025-03-03', user_id=user.id, db=db, if_none_match=None),
+        'monthly_cached': lambda: main.get_monthly_comparison('2025-03', user_id=user.id, db=db, if_none_match=None),
+        'past_cached': lambda: main.get_all_past_appointments(user_id=user.id, db=db, if_none_match=None),
+    }
+    result = {'backend': engine.dialect.name, 'rows': rows}
+    for name, call in calls.items():
+        call()  # warm up
+        timings = []
+        for _ in range(repeat):
+            statements.clear()
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+        result[f'{name}_ms'] = round(statistics.median(timings) * 1000, 1)
+        result[f'{name}_statements'] = len(statements)
+    db.close()
+
+    print(json.dumps(result))
+
+
+def analytics(args):
+    for rows in args.rows:
+        url = args.database_url or f"sqlite:///{tempfile.mktemp(suffix='.db')}"
+        env = dict(os.environ, DATABASE_URL=url)
+        command = [sys.executable, __file__, '_analytics-child', str(rows)]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        print(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload pipeline benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    memory = commands.add_parser('upload-memory', help='peak RSS while ingesting uploads of different sizes')
+    memory.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    memory.add_argument('--past', action='store_true', help='past appointments instead of upcoming')
+    memory.add_argument('--upsert', action='store_true', help='sync the file against the same rows already stored')
+    memory.set_defaults(func=upload_memory)
+
+    child = commands.add_parser('_upload-memory-child')
+    child.add_argument('rows', type=int)
+    child.add_argument('--past', action='store_true')
+    child.add_argument('--upsert', action='store_true')
+    child.set_defaults(func=lambda a: run_upload_memory(a.rows, a.past, a.upsert))
+
+    bulk = commands.add_parser('insert', help='ORM add_all + flush vs insert_rows for patients and predictions')
+    bulk.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    bulk.add_argument('--database-url', help='defaults to a throwaway SQLite file, use an empty database')
+    bulk.set_defaults(func=insert)
+
+    child = commands.add_parser('_insert-child')
+    child.add_argument('rows', type=int)
+    child.set_defaults(func=lambda a: run_insert(a.rows))
+
+    formats = commands.add_parser('upload-formats', help='upload size and ingest time for csv, gzip, zstd, parquet and arrow')
+    formats.add_argument('--rows', type=int, nargs='+', default=[100_000])
+    formats.add_argument('--past', action='store_true', help='past appointments instead of upcoming')
+    formats.set_defaults(func=upload_formats)
+
+    child = commands.add_parser('_upload-formats-child')
+    child.add_argument('rows', type=int)
+    child.add_argument('--past', action='store_true')
+    child.set_defaults(func=lambda a: run_upload_formats(a.rows, a.past))
+
+    timing = commands.add_parser('analytics', help='weekly/monthly analytics and /past response time for one user, uncached and cached')
+    timing.add_argument('--rows', type=int, nargs='+', default=[100_000])
+    timing.add_argument('--database-url', help='defaults to a throwaway SQLite file, use an empty database')
+    timing.set_defaults(func=analytics)
+
+    child = commands.add_parser('_analytics-child')
+    child.add_argument('rows', type=int)
+    child.set_defaults(func=lambda a: run_analytics(a.rows))
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
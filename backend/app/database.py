@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, Boolean, Float, DateTime, ForeignKey, String
+import csv
+import io
+from sqlalchemy import Column, Integer, Boolean, Float, Date, DateTime, ForeignKey, Index, String, Text, UniqueConstraint, insert, update, text
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
@@ -19,6 +21,7 @@ class User(Base):
     hashed_password = Column(String(255), nullable=False)
     practice_name = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")  # bumped by every data write
 
 
     patients = relationship("Patient", back_populates="user", cascade="all, delete-orphan")
@@ -29,10 +32,11 @@ class User(Base):
 
 class Patient(Base):
     __tablename__ = "patients"
+    __table_args__ = (Index("ix_patients_user_id_appointment_date", "user_id", "appointment_date"),)
 
     id = Column(Integer, primary_key=True, index=True)  # DB auto-increment ID
     patient_id = Column(Integer, nullable=False, index=True)  # CSV patient ID
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # leads ix_patients_user_id_appointment_date
     age = Column(Integer, nullable=False)
     days_lps = Column(Integer, nullable=False)
     employed = Column(Boolean, nullable=False)
@@ -42,7 +46,10 @@ class Patient(Base):
     varifocal = Column(Boolean, nullable=False)
     high_rx = Column(Boolean, nullable=False)
     appointment_date = Column(DateTime, nullable=False, index=True)
+    # current prediction, written at upload - predictions keeps the history
     predicted_spend = Column(Float, nullable=True)
+    purchase_probability = Column(Float, nullable=True)
+    model_version = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     user = relationship("User", back_populates="patients")
@@ -55,7 +62,7 @@ class Prediction(Base):
     __tablename__ = "predictions"
 
     id = Column(Integer, primary_key=True, index=True)
-    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), nullable=False)
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), nullable=False, index=True)
     purchase_probability = Column(Float, nullable=False)
     predicted_spend = Column(Float, nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -68,9 +75,10 @@ class Prediction(Base):
 
 class Past(Base):
     __tablename__ = "past"
+    __table_args__ = (Index("ix_past_user_id_appointment_date", "user_id", "appointment_date"),)
 
     id = Column(Integer, primary_key=True, index=True)  # DB auto-increment ID
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # leads ix_past_user_id_appointment_date
     patient_id = Column(Integer, nullable=False, index=True)  # CSV patient ID
     age = Column(Integer, nullable=False)
     days_lps = Column(Integer, nullable=False)
@@ -89,6 +97,35 @@ class Past(Base):
     user = relationship("User", back_populates="past_appointments")
 
 
+# per user, kind and day totals - analytics read these instead of the raw rows
+
+class DailyTotal(Base):
+    __tablename__ = "daily_totals"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    kind = Column(String(16), primary_key=True)  # upcoming (patients) / past
+    day = Column(Date, primary_key=True)
+    appointments = Column(Integer, nullable=False)
+    predicted_spend = Column(Float, nullable=True)
+    actual_spend = Column(Float, nullable=True)  # past only
+    mean_probability = Column(Float, nullable=True)  # upcoming only
+
+
+# last upload per user and kind - lets an identical re-upload skip all the work
+
+class Upload(Base):
+    __tablename__ = "uploads"
+    __table_args__ = (UniqueConstraint("user_id", "kind"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String(16), nullable=False)  # upcoming / past
+    content_hash = Column(String(64), nullable=False)  # sha256 of the uploaded bytes
+    model_version = Column(String(64), nullable=False)
+    result = Column(Text, nullable=False)  # json MessageResponse returned for it
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
 
 
 # Get the directory where this database.py file is located
@@ -110,7 +147,8 @@ if DATABASE_URL.startswith("postgres://"):
 if DATABASE_URL.startswith("sqlite"):
     engine = create_engine(
         DATABASE_URL,
-        connect_args={"check_same_thread": False}
+        # a write waits this many seconds for another connection's write to finish before "database is locked"
+        connect_args={"check_same_thread": False, "timeout": float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))}
     )
 else:
     # PostgreSQL settings
@@ -128,6 +166,105 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 def create_tables():
     Base.metadata.create_all(bind=engine)
 
+    # create_all skips tables that already exist, add indexes declared since then
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+
+# bulk writes
+
+def is_postgres(db) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def insert_rows(db, model, rows, return_ids=False):
+    #set-based insert of plain dicts inside the session's transaction
+    #returns the new primary keys in row order when return_ids is set
+    if not rows:
+        return []
+
+    if is_postgres(db):
+        return copy_rows(db, model, rows, return_ids)
+
+    statement = insert(model)
+    if not return_ids:
+        db.execute(statement, rows)  # executemany
+        return []
+
+    if db.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = db.execute(statement.returning(model.id, sort_by_parameter_order=True), rows)
+        return result.scalars().all()
+
+    # no multi-row RETURNING (old SQLite) - one statement per row
+    return [db.execute(statement, row).inserted_primary_key[0] for row in rows]
+
+
+def update_rows(db, model, rows):
+    #executemany UPDATE by primary key, every row dict carries its 'id'
+    if rows:
+        db.execute(update(model), rows)
+
+
+def delete_rows(db, model, ids, column=None, batch_size=500):
+    #DELETE ... WHERE column IN (...) in batches that stay under the bind parameter limit
+    column = model.id if column is None else column
+    ids = list(ids)
+    deleted = 0
+    for start in range(0, len(ids), batch_size):
+        deleted += db.query(model).filter(column.in_(ids[start:start + batch_size])).delete(synchronize_session=False)
+    return deleted
+
+
+def copy_value(value):
+    if value is None:
+        return ""  # NULL in COPY csv format
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return value
+
+
+def copy_rows(db, model, rows, return_ids=False):
+    #PostgreSQL COPY FROM STDIN, ids are reserved from the sequence first so they can be returned
+    table = model.__table__
+    columns = list(rows[0])
+    extra = []
+
+    ids = []
+    if return_ids:
+        ids = db.execute(
+            text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)"),
+            {"table": table.name, "n": len(rows)}
+        ).scalars().all()
+
+    # COPY skips python-side defaults, fill them in here
+    defaults = {
+        column.name: column.default.arg
+        for column in table.columns
+        if column.default is not None and column.name not in columns and column.name != "id"
+    }
+    for name, default in defaults.items():
+        extra.append(copy_value(default(None) if callable(default) else default))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for i, row in enumerate(rows):
+        values = [copy_value(row[name]) for name in columns] + extra
+        if return_ids:
+            values.insert(0, ids[i])
+        writer.writerow(values)
+    buffer.seek(0)
+
+    copy_columns = (["id"] if return_ids else []) + columns + list(defaults)
+    cursor = db.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(copy_columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    return ids
 
 
 def get_db():
@@ -1,14 +1,21 @@
+import base64
 import os
 import io
-import csv
-from datetime import datetime, timedelta
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+import shutil
+import tempfile
+import time
+import threading
+from functools import partial
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+import numpy as np
+from fastapi import FastAPI, Depends, Header, HTTPException, status, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func, or_, select
 
 from demo_csv_generator import get_demo_past_csv, get_demo_upcoming_csv
 
@@ -16,12 +23,19 @@ from schemas import (
     PatientInput, PredictionOutput,
     UserCreate, UserLogin, Token, UserResponse,
     PatientResponse, WeeklySalesResponse, MonthlySalesResponse,
-    MessageResponse, PastAppointmentResponse
+    MessageResponse, PastAppointmentResponse, PastAppointmentPage
 )
-from database import Patient, Prediction, User, Past, create_tables, get_db
-from models import forest_classifier as fc
-from models import linear_classifier as lc
-from auth import hash_password, verify_password, create_access_token, get_current_user_id
+from database import DailyTotal, Patient, User, Past, SessionLocal, engine, get_db
+from migrations import upgrade
+from rollups import clear_daily_totals
+from models import model_store
+from prediction_cache import PredictionCache
+from response_cache import (bump_data_version, cache_key, data_version, etag_matches, make_response_cache,
+                            response_etag)
+from uploads import (encode_features, delete_patients, ingest_upcoming, ingest_past, no_progress, sync_upcoming,
+                     sync_past, upload_format, UPLOAD_SUFFIXES, content_hash, previous_upload, remember_upload, forget_uploads)
+from upload_jobs import QueueFull, UploadJob, UploadJobQueue, UploadLocks
+from auth import hash_password, verify_password, create_access_token, get_current_user_id, require_admin_token
 
 app = FastAPI(title="Optometry Purchase Predictor V2.0", version="2.0.0")
 
@@ -39,33 +53,105 @@ app.add_middleware(
 )
 
 
-# ML models
-forest_model = fc.Forest()
-linear_model = lc.Linear()
+# ML models - the active bundle is replaced as a whole on reload, never mutated in place
+active_models = None
+model_swap_lock = threading.Lock()
 
+# optional precomputed lookup over the discrete feature space (PREDICTION_TABLE=1)
+USE_PREDICTION_TABLE = os.getenv("PREDICTION_TABLE", "0") == "1"
 
-@app.on_event("startup")
-async def startup_event():
+# memo of recent predictions, entries are dropped whenever the model version changes
+prediction_cache = PredictionCache(max_size=int(os.getenv("PREDICTION_CACHE_SIZE", "10000")))
+# batches with more distinct rows than this skip the memo - upload chunks mostly miss it, and a python
+# lookup per row costs more than scoring them all vectorised
+PREDICTION_CACHE_BATCH_MAX = int(os.getenv("PREDICTION_CACHE_BATCH_MAX", "1000"))
 
+# encoded read/analytics responses per user and data version (RESPONSE_CACHE_MB / RESPONSE_CACHE_URL)
+response_cache = make_response_cache()
 
-    create_tables()
-    print("✅ Database tables created")
 
-    print("Training Forest model...")
-    try:
-        x, y = forest_model.prepare_rf("data")
-        forest_model.train_rf(x, y)
-        print("✅ Forest model trained successfully!")
-    except Exception as e:
-        print(f"❌ Forest model training failed: {e}")
+# model readiness - "loading" until the first load finishes, then "ready" or "failed"
+model_state = {"status": "loading", "version": None, "error": None, "seconds": None, "training": None,
+               "source": None, "swaps": 0, "last_swap_at": None, "previous_version": None,
+               "reloading": False}
+MODEL_RETRY_AFTER = "5"
 
-    print("Training Linear model...")
+
+def load_models(retrain=False):
+    #build a new bundle off the event loop, then swap it in with one reference assignment
+    global active_models
+
+    started = time.perf_counter()
     try:
-        x2, y2 = linear_model.prepare_lp()
-        linear_model.train_lp(x2, y2)
-        print("✅ Linear model trained successfully!")
+        bundle = model_store.load_bundle(retrain=retrain)
     except Exception as e:
-        print(f"❌ Linear model training failed: {e}")
+        # keep serving the old bundle if there is one
+        model_state.update(error=str(e))
+        if active_models is None:
+            model_state.update(status="failed")
+        print(f"❌ Model loading failed: {e}")
+        return
+
+    previous = active_models
+    active_models = bundle  # in-flight requests keep the bundle they already hold
+
+    seconds = round(time.perf_counter() - started, 2)
+    model_state.update(status="ready", version=bundle.version, error=None, seconds=seconds,
+                       training=bundle.training, source=bundle.source)
+    if previous is not None:
+        model_state.update(swaps=model_state["swaps"] + 1, previous_version=previous.version,
+                           last_swap_at=datetime.now(timezone.utc).isoformat())
+        print(f"✅ Swapped models {previous.version} -> {bundle.version}")
+    print(f"✅ Models ready in {seconds:.2f}s")
+
+    # the table is optional, predictions use the models until it is attached
+    if USE_PREDICTION_TABLE:
+        try:
+            table = model_store.load_prediction_table(bundle.forest, bundle.linear)
+            bundle.table = table
+            print(f"✅ Prediction table {table.shape} loaded, {table.nbytes / 1e6:.1f} MB")
+        except Exception as e:
+            print(f"❌ Prediction table failed, using the models directly: {e}")
+
+
+def start_model_load(retrain=False):
+    #one load/swap at a time, returns False if one is already running
+    if not model_swap_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        model_state["reloading"] = True
+        try:
+            load_models(retrain)
+        finally:
+            model_state["reloading"] = False
+            model_swap_lock.release()
+
+    threading.Thread(target=run, name="model-loader", daemon=True).start()
+    return True
+
+
+def require_models():
+    #dependency for endpoints that score patients - fast 503 until the models are loaded
+    if model_state["status"] != "ready":
+        detail = ("Prediction models failed to load" if model_state["status"] == "failed"
+                  else "Prediction models are loading, try again shortly")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": MODEL_RETRY_AFTER},
+        )
+
+
+@app.on_event("startup")
+async def startup_event():
+
+
+    upgrade()  # creates tables, adds new columns and runs their backfills
+    print("✅ Database tables created")
+
+    # serve traffic straight away, models load in the background
+    start_model_load()
 
 
 
@@ -76,6 +162,20 @@ def health_check():
     return {"status": "healthy", "message": "Optometry Purchase Predictor V2.0 is running"}
 
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness - 200 once the prediction models are loaded, 503 before that"""
+    if model_state["status"] != "ready":
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": model_state["status"], "error": model_state["error"]},
+            headers={"Retry-After": MODEL_RETRY_AFTER},
+        )
+
+    return {"status": "ready", "model_version": model_state["version"],
+            "load_seconds": model_state["seconds"]}
+
+
 #Auth
 
 @app.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
@@ -146,212 +246,326 @@ def get_current_user(user_id: int = Depends(get_current_user_id), db: Session =
 
 # csv upload version 2.o
 
-def convert_yn_to_bool(value: str) -> bool:
-    #y/n to bool
-    return value.strip().upper() == 'Y'
+UPLOAD_MODES = ("replace", "upsert")
+UPLOAD_RETRY_AFTER = "10"
+UPLOAD_COPY_BUFFER = 1024 * 1024
+UPLOAD_FORMAT_NAMES = sorted({suffix for suffix, _ in UPLOAD_SUFFIXES})
+
+# background uploads (?background=true), polled through /jobs/{id}
+upload_jobs = UploadJobQueue()
+
+# uploads of the same user and kind run one after another, two replaces would interleave their deletes and inserts
+upload_locks = UploadLocks(single_writer=engine.dialect.name == "sqlite")
+
+
+def check_upload_mode(mode: str):
+    if mode not in UPLOAD_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(UPLOAD_MODES)}")
 
 
+def sync_message(counts: dict, noun: str) -> str:
+    return (f"Synced {noun}: {counts['inserted']} added, {counts['updated']} updated, "
+            f"{counts['deleted']} removed, {counts['unchanged']} unchanged")
+
 def predict_for_patient(age: int, days_lps: int, employed: bool, benefits: bool,
                         driver: bool, vdu: bool, varifocal: bool, high_rx: bool):
 
 
-    # Convert to model format
-    employed_num = 1 if employed else 0
-    benefits_num = 0 if benefits else 1  # Note: inverted
-    driver_num = 1 if driver else 0
-    vdu_num = 1 if vdu else 0
-    varifocal_num = 1 if varifocal else 0
-    high_rx_num = 1 if high_rx else 0
+    features = encode_features(age, days_lps, employed, benefits, driver, vdu, varifocal, high_rx)
 
-    features = [age, days_lps, employed_num, benefits_num, driver_num, vdu_num, varifocal_num, high_rx_num]
+    models = active_models  # hold one bundle for the whole prediction
+    key = prediction_cache.make_key(features)
+    cached = prediction_cache.get(models.version, key)
+    if cached is not None:
+        return cached
 
-    # predictions from ML
-    probability, percentage = forest_model.probability_cal([features])
-    predicted_spend = linear_model.predict_spending(features, linear_model.scaler)
+    result = None
+    if models.table is not None:
+        result = models.table.lookup(features)
 
-    return probability, predicted_spend
+    if result is None:
+        # predictions from ML
+        probability, percentage = models.forest.probability_cal([features])
+        predicted_spend = models.linear.predict_spending(features, models.linear.scaler)
+        result = (probability, predicted_spend)
 
+    prediction_cache.put(models.version, key, result)
+    return result
 
-@app.post("/upload/upcoming", response_model=MessageResponse)
-async def upload_upcoming_csv(
-        file: UploadFile = File(...),
-        user_id: int = Depends(get_current_user_id),
-        db: Session = Depends(get_db)
-):
+
+def score_features(models, features):
+    #table lookup where it covers the rows, models for the rest
+
+    if models.table is not None:
+        probabilities, predicted_spends, hit = models.table.lookup_batch(features)
+        if not hit.all():
+            # out of range rows go through the models
+            misses = features[~hit]
+            probabilities[~hit] = models.forest.probability_batch(misses)
+            predicted_spends[~hit] = models.linear.predict_spending_batch(misses, models.linear.scaler)
+        return probabilities, predicted_spends
+
+    probabilities = models.forest.probability_batch(features)
+    predicted_spends = models.linear.predict_spending_batch(features, models.linear.scaler)
+
+    return probabilities, predicted_spends
+
+
+def predict_for_patients(features, models=None):
+    #batch version - features is an (n, 8) matrix from encode_features rows
+    #models is the bundle an upload holds for all its chunks, the active one when not given
+
+    features = np.asarray(features, dtype=float).reshape(-1, 8)
+    probabilities = np.empty(len(features))
+    predicted_spends = np.empty(len(features))
+    if len(features) == 0:
+        return probabilities, predicted_spends
+
+    # each distinct row is scored once, then spread back over its repeats
+    models = models or active_models
+    unique, inverse = np.unique(features, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if len(unique) > PREDICTION_CACHE_BATCH_MAX:
+        probabilities, predicted_spends = score_features(models, unique)
+        return probabilities[inverse], predicted_spends[inverse]
+
+    # small batches: serve what the cache has, score the rest together
+    probabilities = np.empty(len(unique))
+    predicted_spends = np.empty(len(unique))
+    keys = [prediction_cache.make_key(row) for row in unique]
+    cached = prediction_cache.get_many(models.version, keys)
+    missing = [i for i, value in enumerate(cached) if value is None]
+    for i, value in enumerate(cached):
+        if value is not None:
+            probabilities[i], predicted_spends[i] = value
+
+    if missing:
+        scored_probabilities, scored_spends = score_features(models, unique[missing])
+        probabilities[missing] = scored_probabilities
+        predicted_spends[missing] = scored_spends
+        prediction_cache.put_many(models.version, [
+            (keys[i], (float(probability), float(predicted_spend)))
+            for i, probability, predicted_spend in zip(missing, scored_probabilities, scored_spends)
+        ])
+
+    return probabilities[inverse], predicted_spends[inverse]
+
+
+def process_upcoming(db: Session, user_id: int, stream, mode: str, models, progress=no_progress,
+                     fmt="csv") -> MessageResponse:
+    #writes the upload into the open transaction, run_upload commits
+    #every chunk is scored and stamped with `models`, even if a reload swaps the active bundle meanwhile
+    score = partial(predict_for_patients, models=models)
+    if mode == "upsert":
+        # only new/changed rows are written and re-scored, one transaction
+        counts = sync_upcoming(db, user_id, stream, score, progress=progress, fmt=fmt, model_version=models.version)
+        return MessageResponse(message=sync_message(counts, "patients"), details=counts)
+
+    # Clear existing upcoming appointments (and their prediction history) first, same transaction as the insert
+    delete_patients(db, Patient.user_id == user_id)
+
+    # streamed in chunks - parse, score and insert without holding the whole file
+    count = ingest_upcoming(db, user_id, stream, score, progress=progress, fmt=fmt, model_version=models.version)
+
+    return MessageResponse(
+        message=f"Successfully uploaded {count} patients and generated {count} predictions",
+        details={"patients": count, "predictions": count}
+    )
 
 
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="File must be a CSV")
+def process_past(db: Session, user_id: int, stream, mode: str, models, progress=no_progress,
+                 fmt="csv") -> MessageResponse:
+    score = partial(predict_for_patients, models=models)
+    if mode == "upsert":
+        counts = sync_past(db, user_id, stream, score, progress=progress, fmt=fmt)
+        return MessageResponse(message=sync_message(counts, "past appointments"), details=counts)
 
-    try:
-        # Clear existing upcoming appointments for this user first
-        db.query(Patient).filter(Patient.user_id == user_id).delete()
-        db.commit()
-
-        contents = await file.read()
-        csv_reader = csv.DictReader(io.StringIO(contents.decode('utf-8')))
-
-        # Collect all records in memory first
-        patient_records = []
-        
-        for row in csv_reader:
-            # Parse CSV row
-            patient_id = int(row['id'])
-            age = int(row['age'])
-            days_lps = int(row['days_lps'])
-            employed = convert_yn_to_bool(row['employed'])
-            benefits = convert_yn_to_bool(row['benefits'])
-            driver = convert_yn_to_bool(row['driver'])
-            vdu = convert_yn_to_bool(row['vdu'])
-            varifocal = convert_yn_to_bool(row['varifocal'])
-            high_rx = convert_yn_to_bool(row['high_rx'])
-            appointment_date = datetime.fromisoformat(row['appointment_date'])
-
-            # ML prediction
-            probability, predicted_spend = predict_for_patient(
-                age, days_lps, employed, benefits, driver, vdu, varifocal, high_rx
-            )
+    # Clear existing past appointments for this user first, same transaction as the insert
+    db.query(Past).filter(Past.user_id == user_id).delete()
 
-            patient_records.append({
-                'patient_id': patient_id,
-                'age': age,
-                'days_lps': days_lps,
-                'employed': employed,
-                'benefits': benefits,
-                'driver': driver,
-                'vdu': vdu,
-                'varifocal': varifocal,
-                'high_rx': high_rx,
-                'appointment_date': appointment_date,
-                'probability': float(probability),
-                'predicted_spend': float(predicted_spend)
-            })
-
-        # Bulk insert patients
-        for record in patient_records:
-            patient = Patient(
-                patient_id=record['patient_id'],
-                user_id=user_id,
-                age=record['age'],
-                days_lps=record['days_lps'],
-                employed=record['employed'],
-                benefits=record['benefits'],
-                driver=record['driver'],
-                vdu=record['vdu'],
-                varifocal=record['varifocal'],
-                high_rx=record['high_rx'],
-                appointment_date=record['appointment_date']
-            )
-            db.add(patient)
-        
-        db.flush()  # Get all patient IDs at once
-        
-        # Now add predictions linked to patients
-        patients = db.query(Patient).filter(Patient.user_id == user_id).all()
-        patient_map = {p.patient_id: p.id for p in patients}
-        
-        for record in patient_records:
-            prediction = Prediction(
-                patient_id=patient_map[record['patient_id']],
-                purchase_probability=record['probability'],
-                predicted_spend=record['predicted_spend']
-            )
-            db.add(prediction)
-        
-        db.commit()
+    # streamed in chunks - parse, score and insert without holding the whole file
+    count = ingest_past(db, user_id, stream, score, progress=progress, fmt=fmt)
 
-        return MessageResponse(
-            message=f"Successfully uploaded {len(patient_records)} patients and generated {len(patient_records)} predictions",
-            details={"patients": len(patient_records), "predictions": len(patient_records)}
-        )
+    return MessageResponse(
+        message=f"Successfully uploaded {count} past appointments with predictions",
+        details={"records": count}
+    )
+
+
+UPLOAD_PROCESSORS = {"upcoming": process_upcoming, "past": process_past}
+
+
+def run_upload(db: Session, kind: str, user_id: int, stream, mode: str, fmt: str, upload_hash: str,
+               progress=no_progress) -> MessageResponse:
+    #process and remember the upload's hash in one commit
+    with upload_locks(user_id, kind):
+        models = active_models  # one bundle from the first chunk to the remembered version
+        try:
+            # other server processes on the same database queue on the user's row (sqlite has no row locks)
+            db.execute(select(User.id).where(User.id == user_id).with_for_update())
+            response = UPLOAD_PROCESSORS[kind](db, user_id, stream, mode, models, progress=progress, fmt=fmt)
+            remember_upload(db, user_id, kind, upload_hash, models.version, response.model_dump())
+            bump_data_version(db, user_id)
+            db.commit()
+        except Exception:
+            db.rollback()  # before the lock is released, so the next upload doesn't wait on this transaction
+            raise
+    return response
+
+
+def duplicate_upload(db: Session, kind: str, user_id: int, upload_hash: str):
+    #the stored summary when these exact bytes are already loaded with the current model, else None
+    previous = previous_upload(db, user_id, kind, upload_hash, active_models.version)
+    if previous is None:
+        return None
+    return MessageResponse(
+        message=f"{previous['message']} (identical upload, already processed)",
+        details={**(previous.get('details') or {}), "duplicate": True}
+    )
+
+
+def queue_upload(kind: str, file: UploadFile, mode: str, fmt: str, upload_hash: str, user_id: int):
+    #spool the upload to disk (the request's file is closed once we return) and hand it to a worker
+    spool = tempfile.NamedTemporaryFile(prefix="upload-", delete=False)
+    with spool:
+        shutil.copyfileobj(file.file, spool, UPLOAD_COPY_BUFFER)
+
+    def run(job):
+        db = SessionLocal()
+        try:
+            with open(spool.name, "rb") as stream:
+                return run_upload(db, kind, user_id, stream, mode, fmt, upload_hash, progress=job.advance).model_dump()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+            os.unlink(spool.name)
+
+    job = UploadJob(user_id, kind, mode, file.filename)
+    try:
+        upload_jobs.submit(job, run, discard=lambda: os.unlink(spool.name))
+    except QueueFull as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"Upload queue is full ({e}), try again shortly",
+                            headers={"Retry-After": UPLOAD_RETRY_AFTER})
+
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=MessageResponse(
+        message=f"Upload queued as job {job.id}",
+        details={"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"}
+    ).model_dump())
+
+
+def handle_upload(kind: str, file: UploadFile, mode: str, background: bool, user_id: int, db: Session):
+    head = file.file.read(8)
+    file.file.seek(0)
+    fmt = upload_format(file.filename, head)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail=f"File must be one of: {', '.join(UPLOAD_FORMAT_NAMES)}")
+    check_upload_mode(mode)
+
+    # same bytes + same model as the last upload of this kind - the data is already there
+    upload_hash = content_hash(file.file)
+    duplicate = duplicate_upload(db, kind, user_id, upload_hash)
+    if duplicate is not None:
+        return duplicate
+
+    if background:
+        return queue_upload(kind, file, mode, fmt, upload_hash, user_id)
 
+    try:
+        return run_upload(db, kind, user_id, file.file, mode, fmt, upload_hash)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Error processing CSV: {str(e)}")
 
 
-@app.post("/upload/past", response_model=MessageResponse)
-async def upload_past_csv(
+# plain def so FastAPI runs these on its threadpool instead of blocking the event loop
+@app.post("/upload/upcoming", response_model=MessageResponse, dependencies=[Depends(require_models)])
+def upload_upcoming_csv(
+        file: UploadFile = File(...),
+        mode: str = "replace",
+        background: bool = False,
+        user_id: int = Depends(get_current_user_id),
+        db: Session = Depends(get_db)
+):
+    return handle_upload("upcoming", file, mode, background, user_id, db)
+
+
+@app.post("/upload/past", response_model=MessageResponse, dependencies=[Depends(require_models)])
+def upload_past_csv(
         file: UploadFile = File(...),
+        mode: str = "replace",
+        background: bool = False,
         user_id: int = Depends(get_current_user_id),
         db: Session = Depends(get_db)
 ):
     #csv generate predictions
+    return handle_upload("past", file, mode, background, user_id, db)
 
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="File must be a CSV")
 
-    try:
-        # Clear existing past appointments for this user first
-        db.query(Past).filter(Past.user_id == user_id).delete()
-        db.commit()
-
-        contents = await file.read()
-        csv_reader = csv.DictReader(io.StringIO(contents.decode('utf-8')))
-
-        # Collect all records in memory first
-        past_records = []
-        
-        for row in csv_reader:
-            # Parse CSV row
-            patient_id = int(row['id'])
-            age = int(row['age'])
-            days_lps = int(row['days_lps'])
-            employed = convert_yn_to_bool(row['employed'])
-            benefits = convert_yn_to_bool(row['benefits'])
-            driver = convert_yn_to_bool(row['driver'])
-            vdu = convert_yn_to_bool(row['vdu'])
-            varifocal = convert_yn_to_bool(row['varifocal'])
-            high_rx = convert_yn_to_bool(row['high_rx'])
-            appointment_date = datetime.fromisoformat(row['appointment_date'])
-            amount_spent = float(row['amount_spent'])
-
-            # ML prediction
-            probability, predicted_spend = predict_for_patient(
-                age, days_lps, employed, benefits, driver, vdu, varifocal, high_rx
-            )
+@app.get("/jobs/{job_id}")
+def get_upload_job(job_id: str, user_id: int = Depends(get_current_user_id)):
+    job = upload_jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
-            # Create past record with both actual and predicted spend
-            past_record = Past(
-                user_id=user_id,
-                patient_id=patient_id,
-                age=age,
-                days_lps=days_lps,
-                employed=employed,
-                benefits=benefits,
-                driver=driver,
-                vdu=vdu,
-                varifocal=varifocal,
-                high_rx=high_rx,
-                appointment_date=appointment_date,
-                amount_spent=amount_spent,
-                predicted_spend=float(predicted_spend)
-            )
-            past_records.append(past_record)
 
-        # Bulk insert all at once
-        db.bulk_save_objects(past_records)
-        db.commit()
 
-        return MessageResponse(
-            message=f"Successfully uploaded {len(past_records)} past appointments with predictions",
-            details={"records": len(past_records)}
-        )
 
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=f"Error processing CSV: {str(e)}")
+# retrieve data
 
+PAST_PAGE_SIZE = int(os.getenv("PAST_PAGE_SIZE", "500"))  # /past rows per page by default
+PAST_PAGE_MAX = int(os.getenv("PAST_PAGE_MAX", "5000"))  # larger ?limit= values are capped to this
 
+# /past field name -> column, the csv patient id is served as "id"
+PAST_COLUMNS = {name: Past.patient_id if name == "id" else getattr(Past, name)
+                for name in PastAppointmentResponse.model_fields}
 
+def day_start(day) -> datetime:
+    return datetime(day.year, day.month, day.day)
+
+
+def day_range(column, first_day, end_day=None):
+    #half-open [first_day, end_day) timestamp range, next day by default
+    #compares the raw column so the (user_id, appointment_date) index can be range scanned, unlike date(column)
+    end_day = end_day or first_day + timedelta(days=1)
+    return column >= day_start(first_day), column < day_start(end_day)
+
+
+# serializers for the cached endpoints - validate + dump like FastAPI's response_model does
+RESPONSE_TYPES = {
+    "patients_by_date": TypeAdapter(List[PatientResponse]),
+    "past": TypeAdapter(PastAppointmentPage),
+    "weekly": TypeAdapter(List[WeeklySalesResponse]),
+    "monthly": TypeAdapter(MonthlySalesResponse),
+}
+
+
+# browsers keep the body but revalidate every time, an unchanged ETag costs one version lookup
+CACHE_HEADERS = {"Cache-Control": "private, no-cache"}
+
+
+def cached_json(db: Session, user_id: int, endpoint: str, params: str, compute, if_none_match=None) -> Response:
+    #the encoded response for the user's current data version, compute() only runs on a miss
+    #304 when the client already has it - decided from the version alone, before any rows are loaded
+    key = cache_key(user_id, data_version(db, user_id), endpoint, params)
+    headers = {"ETag": response_etag(key), **CACHE_HEADERS}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    adapter = RESPONSE_TYPES[endpoint]
+    body = response_cache.fetch(key, endpoint, lambda: adapter.dump_json(adapter.validate_python(compute())))
+    return Response(content=body, media_type="application/json", headers=headers)
 
-# retrieve data
 
 @app.get("/patients/date/{date}", response_model=List[PatientResponse])
 def get_patients_by_date(
         date: str,
         user_id: int = Depends(get_current_user_id),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        if_none_match: Optional[str] = Header(None)
 ):
 
 
@@ -360,67 +574,82 @@ def get_patients_by_date(
     except:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
-    # query px
-    patients = db.query(Patient).filter(
-        Patient.user_id == user_id,
-        func.date(Patient.appointment_date) == target_date
-    ).all()
+    return cached_json(db, user_id, "patients_by_date", target_date.isoformat(),
+                       lambda: patients_on(db, user_id, target_date), if_none_match)
 
-    # c predictions
-    result = []
-    for patient in patients:
-        prediction = db.query(Prediction).filter(
-            Prediction.patient_id == patient.id
-        ).first()
-
-        if prediction:
-            result.append({
-                "id": patient.id,
-                "age": patient.age,
-                "days_lps": patient.days_lps,
-                "employed": patient.employed,
-                "benefits": patient.benefits,
-                "driver": patient.driver,
-                "vdu": patient.vdu,
-                "varifocal": patient.varifocal,
-                "high_rx": patient.high_rx,
-                "appointment_date": patient.appointment_date,
-                "predicted_spend": prediction.predicted_spend,
-                "purchase_probability": prediction.purchase_probability,
-                "created_at": patient.created_at
-            })
 
-    return result
+def patients_on(db: Session, user_id: int, target_date):
+    # patients carry their current prediction, one table, columns only
+    rows = db.query(
+        Patient.id, Patient.age, Patient.days_lps, Patient.employed, Patient.benefits, Patient.driver,
+        Patient.vdu, Patient.varifocal, Patient.high_rx, Patient.appointment_date,
+        Patient.predicted_spend, Patient.purchase_probability, Patient.model_version, Patient.created_at
+    ).filter(
+        Patient.user_id == user_id,
+        *day_range(Patient.appointment_date, target_date),
+        Patient.purchase_probability.isnot(None)
+    ).order_by(Patient.appointment_date, Patient.id).all()
+
+    return [row._asdict() for row in rows]
 
 
-@app.get("/past", response_model=List[PastAppointmentResponse])
+@app.get("/past", response_model=PastAppointmentPage)
 def get_all_past_appointments(
+        cursor: Optional[str] = None,
+        limit: int = PAST_PAGE_SIZE,
+        fields: Optional[str] = None,
         user_id: int = Depends(get_current_user_id),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        if_none_match: Optional[str] = Header(None)
 ):
+    #one page of past appointments in (appointment_date, id) order, ?cursor= from the last page for the next one
+    after = decode_cursor(cursor) if cursor else None
+    limit = min(max(limit, 1), PAST_PAGE_MAX)
+    names = past_fields(fields)
 
+    params = f"{cursor or ''}:{limit}:{','.join(names)}"
+    return cached_json(db, user_id, "past", params, lambda: past_page(db, user_id, after, limit, names), if_none_match)
 
-    past_records = db.query(Past).filter(Past.user_id == user_id).all()
 
-    result = []
-    for record in past_records:
-        result.append({
-            "id": record.patient_id,
-            "age": record.age,
-            "days_lps": record.days_lps,
-            "employed": record.employed,
-            "benefits": record.benefits,
-            "driver": record.driver,
-            "vdu": record.vdu,
-            "varifocal": record.varifocal,
-            "high_rx": record.high_rx,
-            "appointment_date": record.appointment_date,
-            "amount_spent": record.amount_spent,
-            "predicted_spend": record.predicted_spend,  # <-- ADD THIS
-            "created_at": record.created_at
-        })
+def past_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(PAST_COLUMNS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in PAST_COLUMNS]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"fields must be from: {', '.join(PAST_COLUMNS)}")
+    return list(dict.fromkeys(names))
 
-    return result
+
+def encode_cursor(appointment_date: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{appointment_date.isoformat()}|{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        appointment_date, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(appointment_date), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def past_page(db: Session, user_id: int, after, limit: int, names: List[str]):
+    #keyset page - only the asked-for columns, one row over the limit tells whether another page follows
+    query = select(*(PAST_COLUMNS[name].label(name) for name in names),
+                   Past.appointment_date.label("_date"), Past.id.label("_id")).where(Past.user_id == user_id)
+    if after is not None:
+        # the >= bound range scans (user_id, appointment_date), the id breaks ties within one timestamp
+        after_date, after_id = after
+        query = query.where(Past.appointment_date >= after_date,
+                            or_(Past.appointment_date > after_date, Past.id > after_id))
+    rows = db.execute(query.order_by(Past.appointment_date, Past.id).limit(limit + 1)).all()
+
+    next_cursor = encode_cursor(rows[limit - 1]._date, rows[limit - 1]._id) if len(rows) > limit else None
+    return {
+        "items": [dict(zip(names, row)) for row in rows[:limit]],
+        "next_cursor": next_cursor,
+        "limit": limit,
+    }
 
 
 @app.get("/past/date/{date}", response_model=List[PastAppointmentResponse])
@@ -438,7 +667,7 @@ def get_past_by_date(
 
     past_records = db.query(Past).filter(
         Past.user_id == user_id,
-        func.date(Past.appointment_date) == target_date
+        *day_range(Past.appointment_date, target_date)
     ).all()
 
     result = []
@@ -465,7 +694,8 @@ def get_past_by_date(
 def get_weekly_forecast(
         start_date: str,
         user_id: int = Depends(get_current_user_id),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        if_none_match: Optional[str] = Header(None)
 ):
     #week view
 
@@ -474,32 +704,27 @@ def get_weekly_forecast(
     except:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
-    weekly_data = []
+    return cached_json(db, user_id, "weekly", start.isoformat(), lambda: weekly_totals(db, user_id, start),
+                       if_none_match)
 
-    for week in range(4):
-        week_start = start + timedelta(days=week * 7)
-        week_end = week_start + timedelta(days=6)
 
+def weekly_totals(db: Session, user_id: int, start):
+    # week boundaries, the last one is the exclusive end of week 4
+    bounds = [start + timedelta(days=week * 7) for week in range(5)]
+    week = case(*((DailyTotal.day < bounds[i + 1], i) for i in range(3)), else_=3).label("week")
 
-        patients = db.query(Patient).filter(
-            Patient.user_id == user_id,
-            func.date(Patient.appointment_date) >= week_start,
-            func.date(Patient.appointment_date) <= week_end
-        ).all()
+    # summed from the per-day rollup, at most 28 rows
+    totals = dict(db.query(week, func.sum(DailyTotal.predicted_spend)).filter(
+        DailyTotal.user_id == user_id,
+        DailyTotal.kind == "upcoming",
+        DailyTotal.day >= bounds[0],
+        DailyTotal.day < bounds[4]
+    ).group_by("week").all())
 
-        # Sum predictions
-        total_predicted = 0.0
-        for patient in patients:
-            prediction = db.query(Prediction).filter(
-                Prediction.patient_id == patient.id
-            ).first()
-            if prediction:
-                total_predicted += prediction.predicted_spend
-
-        weekly_data.append({
-            "date": week_start.isoformat(),
-            "total_predicted": round(total_predicted, 2)
-        })
+    weekly_data = [
+        {"date": bounds[i].isoformat(), "total_predicted": round(totals.get(i) or 0.0, 2)}
+        for i in range(4)
+    ]
 
     return weekly_data
 
@@ -508,7 +733,8 @@ def get_weekly_forecast(
 def get_monthly_comparison(
         month: str,
         user_id: int = Depends(get_current_user_id),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        if_none_match: Optional[str] = Header(None)
 ):
 
 
@@ -526,29 +752,20 @@ def get_monthly_comparison(
     else:
         month_end = datetime(year, month_num + 1, 1).date()
 
-    # Calculate predicted total
-    patients = db.query(Patient).filter(
-        Patient.user_id == user_id,
-        func.date(Patient.appointment_date) >= month_start,
-        func.date(Patient.appointment_date) < month_end
-    ).all()
-
-    total_predicted = 0.0
-    for patient in patients:
-        prediction = db.query(Prediction).filter(
-            Prediction.patient_id == patient.id
-        ).first()
-        if prediction:
-            total_predicted += prediction.predicted_spend
+    return cached_json(db, user_id, "monthly", month,
+                       lambda: monthly_totals(db, user_id, month, month_start, month_end), if_none_match)
 
-    # Calculate actual
-    past_records = db.query(Past).filter(
-        Past.user_id == user_id,
-        func.date(Past.appointment_date) >= month_start,
-        func.date(Past.appointment_date) < month_end
-    ).all()
 
-    total_actual = sum(record.amount_spent for record in past_records)
+def monthly_totals(db: Session, user_id: int, month: str, month_start, month_end):
+    # predicted (upcoming) and actual (past) totals from the per-day rollup, one statement
+    total_predicted, total_actual = db.query(
+        func.coalesce(func.sum(case((DailyTotal.kind == "upcoming", DailyTotal.predicted_spend))), 0.0),
+        func.coalesce(func.sum(case((DailyTotal.kind == "past", DailyTotal.actual_spend))), 0.0)
+    ).filter(
+        DailyTotal.user_id == user_id,
+        DailyTotal.day >= month_start,
+        DailyTotal.day < month_end
+    ).one()
 
     variance = total_actual - total_predicted #comparison
 
@@ -570,10 +787,13 @@ def clear_user_data(
 
 
     # Delete all
-    patients_deleted = db.query(Patient).filter(Patient.user_id == user_id).delete()
+    patients_deleted = delete_patients(db, Patient.user_id == user_id)
 
 
     past_deleted = db.query(Past).filter(Past.user_id == user_id).delete()
+    clear_daily_totals(db, user_id)
+    forget_uploads(db, user_id)
+    bump_data_version(db, user_id)
 
     db.commit()
 
@@ -595,7 +815,7 @@ def read_root():
     return {"message": "Optometry Purchase Predictor V2.0 API", "version": "2.0.0"}
 
 
-@app.post("/predict", response_model=dict)
+@app.post("/predict", response_model=dict, dependencies=[Depends(require_models)])
 def legacy_predict(patient: PatientInput, db: Session = Depends(get_db)):
 
 
@@ -669,14 +889,16 @@ def get_past_by_date(
 
     past_records = db.query(Past).filter(
         Past.user_id == user_id,
-        func.date(Past.appointment_date) == target_date
+        *day_range(Past.appointment_date, target_date)
     ).all()
 
     for record in past_records:
         if not record.predicted_spend or record.predicted_spend == 0:
-            features = [record.age, record.days_lps, record.employed, record.benefits,
-                        record.driver, record.vdu, record.varifocal, record.high_rx]
-            record.predicted_spend = float(linear_model.predict_spending(features, linear_model.scaler))
+            probability, predicted_spend = predict_for_patient(
+                record.age, record.days_lps, record.employed, record.benefits,
+                record.driver, record.vdu, record.varifocal, record.high_rx
+            )
+            record.predicted_spend = float(predicted_spend)
 
     return past_records
 
@@ -690,6 +912,40 @@ async def serve_predictor():
     raise HTTPException(status_code=404, detail="Predictor page not found")
 
 
+@app.post("/admin/models/reload", status_code=status.HTTP_202_ACCEPTED,
+          dependencies=[Depends(require_admin_token)])
+def reload_models(retrain: bool = False):
+    """Load the newest artifact (or retrain with ?retrain=true) in the background and swap it in"""
+    if not start_model_load(retrain):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A model reload is already running")
+
+    return {"message": "Model reload started", "current_version": model_state["version"], "retrain": retrain}
+
+
+@app.get("/debug/model")
+def model_info():
+    """Loaded model version, load time and per-stage training timings"""
+    return model_state
+
+
+@app.get("/debug/prediction-cache")
+def prediction_cache_stats():
+    """Hit/miss/eviction counters for the prediction memo cache"""
+    return prediction_cache.stats()
+
+
+@app.get("/debug/response-cache")
+def response_cache_stats():
+    """Backend, memory use and per-endpoint hit rates for the response cache"""
+    return response_cache.stats()
+
+
+@app.get("/debug/upload-jobs")
+def upload_job_stats():
+    """Worker pool size, queue depth and job counts by status"""
+    return upload_jobs.stats()
+
+
 @app.get("/debug/check-predictor")
 async def check_predictor():
     """Debug endpoint to check if predictor2.html exists"""
@@ -0,0 +1,97 @@
+"""
+Schema upgrades for existing databases, run on startup:
+
+    python migrations.py              # add missing columns + run their backfills
+    python migrations.py --backfill   # re-run every backfill
+"""
+
+import argparse
+
+from sqlalchemy import inspect, select, text, update
+from sqlalchemy.orm import Session
+
+from database import Base, Patient, Prediction, create_tables, engine
+from rollups import refresh_daily_totals
+
+
+def add_missing_columns(connection):
+    #ALTER TABLE ... ADD COLUMN for model columns an older database lacks
+    #NOT NULL columns are only added when they have a server default to fill the existing rows
+    inspector = inspect(connection)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            definition = column.type.compile(dialect=connection.dialect)
+            if not column.nullable:
+                if column.server_default is None:
+                    print(f"⚠️ {table.name}.{column.name} is NOT NULL, add it by hand")
+                    continue
+                definition += f" DEFAULT {column.server_default.arg} NOT NULL"
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {definition}"))
+            added.append((table.name, column.name))
+    return added
+
+
+def backfill_patient_predictions(connection):
+    #copy each patient's newest prediction onto the patient row in one UPDATE, model version is unknown for these
+    #newest, not first - on sqlite a reused patient id can still carry an older patient's predictions
+    patients = Patient.__table__
+    predictions = Prediction.__table__
+
+    def latest_prediction(column):
+        return (select(column).where(predictions.c.patient_id == patients.c.id)
+                .order_by(predictions.c.id.desc()).limit(1).scalar_subquery())
+
+    has_prediction = select(predictions.c.id).where(predictions.c.patient_id == patients.c.id).exists()
+    result = connection.execute(
+        update(patients)
+        .where(patients.c.purchase_probability.is_(None), has_prediction)
+        .values(predicted_spend=latest_prediction(predictions.c.predicted_spend),
+                purchase_probability=latest_prediction(predictions.c.purchase_probability))
+    )
+    return result.rowcount
+
+
+def backfill_daily_totals(connection):
+    #rebuild every user's rollup rows from patients and past
+    refresh_daily_totals(Session(bind=connection))
+    return connection.execute(text("SELECT COUNT(*) FROM daily_totals")).scalar()
+
+
+# backfill to run when a column (or a whole table, column None) is first added
+BACKFILLS = {
+    ("patients", "purchase_probability"): backfill_patient_predictions,
+    ("daily_totals", None): backfill_daily_totals,
+}
+
+
+def upgrade(backfill_all=False):
+    #create new tables, add new columns, then run the backfills that go with them
+    existing_tables = set(inspect(engine).get_table_names())
+    create_tables()
+
+    with engine.begin() as connection:
+        added = add_missing_columns(connection)
+        for table, column in added:
+            print(f"✅ Added column {table}.{column}")
+        added += [(table.name, None) for table in Base.metadata.sorted_tables if table.name not in existing_tables]
+
+        for key, backfill in BACKFILLS.items():
+            if backfill_all or key in added:
+                print(f"✅ Backfilled {backfill(connection)} rows with {backfill.__name__}")
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade the database schema in place")
+    parser.add_argument("--backfill", action="store_true", help="re-run every backfill, not just for new columns")
+    args = parser.parse_args()
+
+    upgrade(backfill_all=args.backfill)
+
+
+if __name__ == "__main__":
+    main()
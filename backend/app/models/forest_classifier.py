@@ -1,24 +1,86 @@
-import pandas as pd
+import time
+
+import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score
 
+from models.training_data import load_training_data
+
+class FlatForest:
+    #fitted forest exported to contiguous node arrays, all trees evaluated together
+
+    def __init__(self, feature, threshold, left, right, leaf_value, roots, max_depth, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.leaf_value = leaf_value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features = n_features
+
+    @classmethod
+    def from_sklearn(cls, rf):
+        features, thresholds, lefts, rights, leaf_values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+
+        for estimator in rf.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            # leaves point at themselves so extra traversal steps are no-ops
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+
+            # positive class share of each node, same as predict_proba per tree
+            value = tree.value[:, 0, :]
+            leaf_values.append(value[:, 1] / value.sum(axis=1))
+
+            roots.append(offset)
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            np.concatenate(features).astype(np.intp),
+            np.concatenate(thresholds).astype(np.float64),
+            np.concatenate(lefts).astype(np.intp),
+            np.concatenate(rights).astype(np.intp),
+            np.concatenate(leaf_values).astype(np.float64),
+            np.asarray(roots, dtype=np.intp),
+            max_depth,
+            rf.n_features_in_,
+        )
+
+    def predict_proba(self, data):
+        # sklearn compares float32 inputs against the thresholds, do the same
+        x = np.asarray(data, dtype=np.float32).reshape(-1, self.n_features)
+        rows = np.arange(len(x))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(x), len(self.roots)))
+
+        for _ in range(self.max_depth):
+            go_left = x[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        return self.leaf_value[nodes].mean(axis=1)
+
+
 class Forest:
     def __init__(self):
         self.model = None
+        self.version = None
+        self.flat = None
+        self.timings = {}
+        self.metrics = {}
 
 
     def prepare_rf(self, data):
-        df = pd.read_csv("data/realistic_optometry_data_10000.csv", delimiter=",")
-        df['Employed'] = df['Employed'].apply(lambda x: 1 if x == 'Y' else 0)
-        df['Benefits'] = df['Benefits'].apply(lambda x: 0 if x == 'Y' else 1)
-        df['Driver'] = df['Driver'].apply(lambda x: 1 if x == 'Y' else 0)
-        df['VDU'] = df['VDU'].apply(lambda x: 1 if x == 'Y' else 0)
-        df['Varifocal'] = df['Varifocal'].apply(lambda x: 1 if x == 'Y' else 0)
-        df['High_Rx'] = df['High_Rx'].apply(lambda x: 1 if x == 'Y' else 0)
-        feature_columns = ['Age', 'Days_LPS', 'Employed', 'Benefits', 'Driver', 'VDU', 'Varifocal', 'High_Rx']
-        x = df[feature_columns]
-        y = (df['Spent'] >= 100).astype(int)
+        x, spent = load_training_data()
+        y = (spent >= 100).astype(int)
         return x, y
 
     def forest_api_data(self, features):
@@ -26,18 +88,42 @@ class Forest:
 
         return x_new
 
-    def train_rf(self, x, y):
+    def train_rf(self, x, y, n_jobs=None):
+        # n_jobs=-1 builds trees on every core
         x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=0.2, random_state=42)
-        rf = RandomForestClassifier(n_estimators=100, random_state=42)
+        rf = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=n_jobs)
+        started = time.perf_counter()
         rf.fit(x_train, y_train)
+        fitted = time.perf_counter()
         y_pred = rf.predict(x_test)
         accuracy = accuracy_score(y_test, y_pred)
+        evaluated = time.perf_counter()
+        # the cores were for training - predictions in the server stay on the calling thread
+        rf.n_jobs = None
         self.model = rf
+        self.compile()
+        self.timings = {"fit": fitted - started, "evaluate": evaluated - fitted,
+                        "compile": time.perf_counter() - evaluated}
+        self.metrics = {"accuracy": accuracy}
         return self.model
 
+    def compile(self):
+        #export the fitted trees for the fast single-row path
+        self.flat = FlatForest.from_sklearn(self.model)
+        return self.flat
+
     def probability_cal(self, data):
-        probability = self.model.predict_proba(data)[0][1]
+        if self.flat is not None:
+            probability = float(self.flat.predict_proba(data)[0])
+        else:
+            probability = self.model.predict_proba(data)[0][1]
         percentage = probability * 100
 
         return probability, percentage
 
+    def probability_batch(self, data):
+        # one predict_proba call for a whole feature matrix
+        probabilities = self.model.predict_proba(data)[:, 1]
+
+        return probabilities
+
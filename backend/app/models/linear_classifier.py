@@ -1,4 +1,4 @@
-import pandas as pd
+import time
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LinearRegression
 import numpy as np
@@ -6,21 +6,20 @@ from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import StandardScaler
 
+from models.training_data import load_training_data
+
 class Linear:
     def __init__(self):
         self.model = None
         self.scaler = None
+        self.version = None
+        self.coef = None
+        self.intercept = None
+        self.timings = {}
+        self.metrics = {}
 
     def prepare_lp(self):
-        df = pd.read_csv("data/realistic_optometry_data_10000.csv", delimiter =  ",")
-        df['Employed'] = df.Employed.apply(lambda x: 1 if x == 'Y' else 0)
-        df['Benefits'] = df.Benefits.apply(lambda x: 0 if x == 'Y' else 1)
-        df['Driver'] = df.Driver.apply(lambda x: 1 if x == 'Y' else 0)
-        df['VDU'] = df.VDU.apply(lambda x: 1 if x == 'Y' else 0)
-        df['Varifocal'] = df.Varifocal.apply(lambda x: 1 if x == 'Y' else 0)
-        df['High_Rx'] = df.High_Rx.apply(lambda x: 1 if x == 'Y' else 0)
-        x = df[['Age', 'Days_LPS', 'Employed', 'Benefits', 'Driver', 'VDU', 'Varifocal', 'High_Rx']]
-        y = df['Spent']
+        x, y = load_training_data()
         return x,y
 
     def linear_api_data(self, features):
@@ -33,13 +32,38 @@ class Linear:
         x_train_scaled = scaler.fit_transform(x_train)
         x_test_scaled = scaler.transform(x_test)
         lr = LinearRegression()
+        started = time.perf_counter()
         lr.fit(x_train_scaled, y_train)
+        fitted = time.perf_counter()
+        y_pred = lr.predict(x_test_scaled)
+        self.timings = {"fit": fitted - started, "evaluate": time.perf_counter() - fitted}
+        self.metrics = {"mae": mean_absolute_error(y_test, y_pred), "r2": r2_score(y_test, y_pred)}
         self.model = lr
         self.scaler = scaler
+        self.fold_scaler()
         return self.model, scaler
 
+    def fold_scaler(self):
+        # (x - mean) / scale . coef + b  ==  x . (coef / scale) + (b - mean . coef / scale)
+        self.coef = self.model.coef_ / self.scaler.scale_
+        self.intercept = float(self.model.intercept_ - np.dot(self.scaler.mean_, self.coef))
+        return self.coef, self.intercept
+
     def predict_spending(self, features, scaler):
-       
-        features_scaled = scaler.transform([features]) 
+        if self.coef is not None:
+            prediction = float(np.dot(features, self.coef)) + self.intercept
+            return max(0, prediction)  # Prevent negative predictions
+
+        features_scaled = scaler.transform([features])
         prediction = self.model.predict(features_scaled)[0]
         return max(0, prediction)  # Prevent negative predictions
+
+    def predict_spending_batch(self, features, scaler):
+        if self.coef is not None:
+            predictions = np.asarray(features, dtype=float) @ self.coef + self.intercept
+            return np.maximum(0, predictions)  # Prevent negative predictions
+
+        # whole feature matrix in one transform + predict
+        features_scaled = scaler.transform(features)
+        predictions = self.model.predict(features_scaled)
+        return np.maximum(0, predictions)  # Prevent negative predictions
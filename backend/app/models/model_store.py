@@ -0,0 +1,198 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import joblib
+import sklearn
+
+from models.forest_classifier import Forest
+from models.linear_classifier import Linear
+from models.prediction_table import PredictionTable
+from models.training_data import data_hash, load_training_data
+
+MODEL_PATH = Path(os.getenv("MODEL_PATH", Path(__file__).resolve().parent / "trained_models"))
+ARTIFACT_SUFFIX = ".joblib"
+TRAINING_JOBS = int(os.getenv("TRAINING_JOBS", "-1"))  # cores for tree building, -1 = all
+
+
+def make_version(source_hash):
+    # timestamp first so versions sort oldest -> newest by name
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    return f"{timestamp}-{source_hash[:12]}"
+
+
+def train_models(forest: Forest, linear: Linear, n_jobs=TRAINING_JOBS):
+    #fit both models from the training csv at the same time, returns a training report
+    started = time.perf_counter()
+    timings = {}
+
+    # one parse of the csv shared by both models
+    x, spent = load_training_data(timings=timings)
+
+    # sklearn releases the GIL while fitting, so the linear fit runs alongside the forest
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="train") as pool:
+        forest_job = pool.submit(forest.train_rf, x, (spent >= 100).astype(int), n_jobs)
+        linear_job = pool.submit(linear.train_lp, x, spent)
+        forest_job.result()
+        linear_job.result()
+
+    for stage in ("fit", "evaluate"):
+        timings[f"{stage}_forest"] = forest.timings[stage]
+        timings[f"{stage}_linear"] = linear.timings[stage]
+    timings["compile_forest"] = forest.timings["compile"]
+    timings["total"] = time.perf_counter() - started
+
+    version = make_version(data_hash())
+    forest.version = version
+    linear.version = version
+    return {
+        "version": version,
+        "rows": len(x),
+        "n_jobs": n_jobs,
+        "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        "metrics": {**forest.metrics, **linear.metrics},
+    }
+
+
+def save_artifact(forest: Forest, linear: Linear, model_dir=MODEL_PATH, report=None):
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+
+    artifact = {
+        "version": forest.version,
+        "data_hash": data_hash(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "sklearn_version": sklearn.__version__,
+        "forest": forest.model,
+        "linear": linear.model,
+        "scaler": linear.scaler,
+        "training": report,
+    }
+
+    # write then rename so a concurrent loader never sees half a file
+    path = model_dir / f"{forest.version}{ARTIFACT_SUFFIX}"
+    tmp_path = path.with_suffix(".tmp")
+    joblib.dump(artifact, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def list_artifacts(model_dir=MODEL_PATH):
+    model_dir = Path(model_dir)
+    if not model_dir.is_dir():
+        return []
+    return sorted(model_dir.glob(f"*{ARTIFACT_SUFFIX}"))
+
+
+def load_latest_artifact(forest: Forest, linear: Linear, model_dir=MODEL_PATH):
+    #load newest artifact into the given models, returns its metadata or None if there isn't one
+    artifacts = list_artifacts(model_dir)
+    if not artifacts:
+        return None
+
+    artifact = joblib.load(artifacts[-1])
+    if artifact["sklearn_version"] != sklearn.__version__:
+        print(f"⚠️ Artifact {artifact['version']} was saved with scikit-learn "
+              f"{artifact['sklearn_version']}, running {sklearn.__version__}")
+
+    forest.model = artifact["forest"]
+    forest.model.n_jobs = None  # artifacts saved before training reset it still carry the training value
+    forest.compile()
+    linear.model = artifact["linear"]
+    linear.scaler = artifact["scaler"]
+    linear.fold_scaler()
+    forest.version = artifact["version"]
+    linear.version = artifact["version"]
+    return {
+        "version": artifact["version"],
+        "data_hash": artifact["data_hash"],
+        "created_at": artifact["created_at"],
+        "training": artifact.get("training"),
+    }
+
+
+class ModelBundle:
+    #fitted forest + linear pair (and optional table) that is served and swapped as one unit
+
+    def __init__(self, forest: Forest, linear: Linear, training=None, source="artifact"):
+        self.forest = forest
+        self.linear = linear
+        self.training = training
+        self.source = source
+        self.table = None
+
+    @property
+    def version(self):
+        return self.forest.version
+
+
+def load_bundle(model_dir=MODEL_PATH, retrain=False):
+    #newest artifact as a fresh bundle, training (and saving) one when asked or when none exists
+    forest, linear = Forest(), Linear()
+
+    info = None if retrain else load_latest_artifact(forest, linear, model_dir)
+    if info:
+        print(f"✅ Loaded model artifact {info['version']}")
+        return ModelBundle(forest, linear, info["training"], source="artifact")
+
+    print("Training Forest and Linear models...")
+    report = train_models(forest, linear)
+    print(f"✅ Models trained successfully! ({report['version']}, {report['timings']['total']:.2f}s)")
+    try:
+        save_artifact(forest, linear, model_dir, report)
+    except OSError as e:
+        print(f"⚠️ Could not save model artifact: {e}")
+    return ModelBundle(forest, linear, report, source="trained")
+
+
+def load_prediction_table(forest: Forest, linear: Linear, model_dir=MODEL_PATH):
+    #memory-map the table for the current version, building and saving it first if missing
+    table = PredictionTable(forest, linear)
+    path = Path(model_dir) / f"{forest.version}.table.npy"
+    if path.exists():
+        table.load(path)
+        return table
+
+    table.build()
+    try:
+        Path(model_dir).mkdir(parents=True, exist_ok=True)
+        table.save(path)
+        table.load(path)
+    except OSError as e:
+        print(f"⚠️ Could not save prediction table: {e}")
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and store model artifacts")
+    parser.add_argument("command", nargs="?", default="train", choices=["train", "list", "table"])
+    parser.add_argument("--model-dir", default=MODEL_PATH)
+    parser.add_argument("--jobs", type=int, default=TRAINING_JOBS, help="cores for tree building, -1 = all")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for path in list_artifacts(args.model_dir):
+            print(path.name)
+        return
+
+    forest, linear = Forest(), Linear()
+    if args.command == "table":
+        if not load_latest_artifact(forest, linear, args.model_dir):
+            parser.error("no model artifact to build a table for, run train first")
+        table = load_prediction_table(forest, linear, args.model_dir)
+        print(f"✅ Prediction table for {forest.version}: {table.shape}, {table.nbytes / 1e6:.1f} MB")
+        return
+
+    report = train_models(forest, linear, n_jobs=args.jobs)
+    path = save_artifact(forest, linear, args.model_dir, report)
+    print(f"✅ Trained model version {report['version']} -> {path}")
+    for stage, seconds in report["timings"].items():
+        print(f"   {stage:<16} {seconds:.3f}s")
+    print(f"   metrics          {report['metrics']}")
+
+
+if __name__ == "__main__":
+    main()
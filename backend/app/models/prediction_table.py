@@ -0,0 +1,108 @@
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+FLAG_WEIGHTS = np.array([32, 16, 8, 4, 2, 1])
+
+
+class PredictionTable:
+    #precomputed forest probability / linear spend over the discrete feature space
+    AGE_MIN = 18
+    AGE_MAX = 90
+    DAYS_MAX = 1460
+
+    def __init__(self, forest, linear, age_min=AGE_MIN, age_max=AGE_MAX, days_max=DAYS_MAX):
+        self.forest = forest
+        self.age_min = age_min
+        self.age_max = age_max
+        self.days_max = days_max
+        self.probabilities = None
+
+        # integer days between two consecutive forest splits on Days_LPS always take
+        # the same path through every tree, so one column per gap is exact
+        flat = forest.flat
+        is_split = flat.left != np.arange(len(flat.left))
+        splits = np.unique(flat.threshold[is_split & (flat.feature == 1)])
+        gaps = np.searchsorted(splits, np.arange(days_max + 1), side="left")
+        _, self.bucket_days, day_bucket = np.unique(gaps, return_index=True, return_inverse=True)
+        self.day_bucket = day_bucket.astype(np.int16)
+
+        # spend is linear, so only the age + flags part needs tabulating
+        ages = np.arange(age_min, age_max + 1)
+        flags = ((np.arange(64)[:, None] & FLAG_WEIGHTS) > 0).astype(float)
+        self.spend_base = (ages[:, None] * linear.coef[0] + linear.intercept
+                           + (flags @ linear.coef[2:])[None, :])
+        self.days_coef = linear.coef[1]
+
+    @property
+    def shape(self):
+        return (self.age_max - self.age_min + 1, len(self.bucket_days), 64)
+
+    def build(self):
+        ages = np.arange(self.age_min, self.age_max + 1)
+        flags = ((np.arange(64)[:, None] & FLAG_WEIGHTS) > 0).astype(float)
+        table = np.empty(self.shape, dtype=np.float64)
+
+        # one age slice at a time keeps the scoring matrix small
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="X does not have valid feature names")
+            for i, age in enumerate(ages):
+                grid = np.empty((len(self.bucket_days), 64, 8))
+                grid[:, :, 0] = age
+                grid[:, :, 1] = self.bucket_days[:, None]
+                grid[:, :, 2:] = flags[None, :, :]
+                table[i] = self.forest.probability_batch(grid.reshape(-1, 8)).reshape(-1, 64)
+
+        self.probabilities = table
+        return table
+
+    def save(self, path):
+        path = Path(path)
+        tmp_path = path.with_suffix(".tmp.npy")
+        np.save(tmp_path, self.probabilities)
+        tmp_path.replace(path)
+        return path
+
+    def load(self, path):
+        probabilities = np.load(path, mmap_mode="r")
+        if probabilities.shape != self.shape:
+            raise ValueError(f"Prediction table {path} has shape {probabilities.shape}, expected {self.shape}")
+        self.probabilities = probabilities
+        return probabilities
+
+    @property
+    def nbytes(self):
+        total = self.day_bucket.nbytes + self.spend_base.nbytes
+        if self.probabilities is not None:
+            total += self.probabilities.nbytes
+        return total
+
+    def lookup(self, features):
+        #(probability, spend) for one encoded feature row, None when outside the table
+        age, days_lps = features[0], features[1]
+        if (age != int(age) or days_lps != int(days_lps)
+                or not self.age_min <= age <= self.age_max or not 0 <= days_lps <= self.days_max):
+            return None
+
+        age_idx = int(age) - self.age_min
+        flag_idx = int(np.dot(features[2:], FLAG_WEIGHTS))
+        probability = float(self.probabilities[age_idx, self.day_bucket[int(days_lps)], flag_idx])
+        spend = max(0, float(self.spend_base[age_idx, flag_idx] + self.days_coef * days_lps))
+        return probability, spend
+
+    def lookup_batch(self, features):
+        #vectorised lookup, returns probabilities, spends and a mask of rows it covered
+        features = np.asarray(features, dtype=float)
+        age, days_lps = features[:, 0], features[:, 1]
+        hit = ((age == np.floor(age)) & (days_lps == np.floor(days_lps))
+               & (age >= self.age_min) & (age <= self.age_max)
+               & (days_lps >= 0) & (days_lps <= self.days_max))
+
+        age_idx = np.where(hit, age - self.age_min, 0).astype(np.intp)
+        day_idx = self.day_bucket[np.where(hit, days_lps, 0).astype(np.intp)]
+        flag_idx = (features[:, 2:] @ FLAG_WEIGHTS).astype(np.intp)
+
+        probabilities = np.asarray(self.probabilities[age_idx, day_idx, flag_idx], dtype=float)
+        spends = np.maximum(0, self.spend_base[age_idx, flag_idx] + self.days_coef * days_lps)
+        return probabilities, spends, hit
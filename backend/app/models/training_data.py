@@ -0,0 +1,78 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+TRAINING_DATA = "data/realistic_optometry_data_10000.csv"
+CACHE_PATH = Path(os.getenv("TRAINING_CACHE_PATH", Path(__file__).resolve().parent / "trained_models" / "cache"))
+CACHE_FORMAT = 1  # bump when the encoding below changes
+
+FEATURE_COLUMNS = ['Age', 'Days_LPS', 'Employed', 'Benefits', 'Driver', 'VDU', 'Varifocal', 'High_Rx']
+YN_COLUMNS = ['Employed', 'Benefits', 'Driver', 'VDU', 'Varifocal', 'High_Rx']
+INVERTED_COLUMNS = {'Benefits'}  # Y -> 0, matches encode_features in main.py
+
+
+def data_hash(path=TRAINING_DATA):
+    #sha256 of the training csv, ties an artifact to the data it was fitted on
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_training_csv(path=TRAINING_DATA):
+    #one typed read of the csv
+    return pd.read_csv(
+        path,
+        usecols=FEATURE_COLUMNS + ['Spent'],
+        dtype={'Age': np.int32, 'Days_LPS': np.int32, 'Spent': np.float64,
+               **{column: 'category' for column in YN_COLUMNS}},
+    )
+
+
+def encode_training_frame(df):
+    #Y/N columns mapped with a vectorised compare
+    x = np.empty((len(df), len(FEATURE_COLUMNS)), dtype=np.int32)
+    x[:, 0] = df['Age'].to_numpy()
+    x[:, 1] = df['Days_LPS'].to_numpy()
+    for i, column in enumerate(YN_COLUMNS, start=2):
+        is_yes = (df[column] == 'Y').to_numpy()
+        x[:, i] = ~is_yes if column in INVERTED_COLUMNS else is_yes
+
+    return x, df['Spent'].to_numpy()
+
+
+def parse_training_csv(path=TRAINING_DATA):
+    return encode_training_frame(read_training_csv(path))
+
+
+def load_training_data(path=TRAINING_DATA, cache_dir=CACHE_PATH, timings=None):
+    #encoded feature matrix + spend, cached as .npz keyed by the csv hash
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+
+    cache_file = Path(cache_dir) / f"training-v{CACHE_FORMAT}-{data_hash(path)[:16]}.npz"
+    if cache_file.exists():
+        with np.load(cache_file) as cached:
+            x, spent = cached['x'], cached['spent']
+        timings['load'] = time.perf_counter() - started
+        timings['encode'] = 0.0
+    else:
+        df = read_training_csv(path)
+        loaded = time.perf_counter()
+        timings['load'] = loaded - started
+        x, spent = encode_training_frame(df)
+        timings['encode'] = time.perf_counter() - loaded
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(".tmp.npz")
+            np.savez(tmp_file, x=x, spent=spent)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print(f"⚠️ Could not cache training data: {e}")
+
+    return pd.DataFrame(x, columns=FEATURE_COLUMNS), pd.Series(spent, name='Spent')
@@ -0,0 +1,212 @@
+import hashlib
+import importlib
+import os
+import threading
+from collections import Counter, OrderedDict
+
+from sqlalchemy import select, update
+
+from database import User
+
+RESPONSE_CACHE_MB = float(os.getenv("RESPONSE_CACHE_MB", "64"))  # 0 disables the cache
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")  # redis://... to share entries between workers
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds, shared backend only
+RESPONSE_CACHE_TIMEOUT = float(os.getenv("RESPONSE_CACHE_TIMEOUT", "0.5"))  # seconds, shared backend only
+RESPONSE_FORMAT = 2  # bump when a cached endpoint's response shape changes, retires old entries and ETags
+
+
+# per-user data version - bumped in every write transaction, part of every cache key
+
+def data_version(db, user_id: int) -> int:
+    return db.execute(select(User.data_version).where(User.id == user_id)).scalar() or 0
+
+
+def bump_data_version(db, user_id: int):
+    #inside the write's transaction, so readers never see new data under the old version
+    db.execute(update(User).where(User.id == user_id).values(data_version=User.data_version + 1))
+
+
+def cache_key(user_id: int, version: int, endpoint: str, params: str) -> str:
+    return f"{RESPONSE_FORMAT}:{user_id}:{version}:{endpoint}:{params}"
+
+
+def response_etag(key: str) -> str:
+    #strong validator - the same key always encodes to the same bytes
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    #If-None-Match uses weak comparison, "*" matches any current representation
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+class MemoryBackend:
+    #byte-bounded LRU of encoded responses, one per process
+
+    name = "memory"
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        size = len(key) + len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(key) + len(old)
+            self._entries[key] = body
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, old_body = self._entries.popitem(last=False)
+                self.bytes -= len(old_key) + len(old_body)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "evictions": self.evictions}
+
+
+class RedisBackend:
+    #entries shared by every worker pointed at the same server, old versions expire by TTL
+
+    name = "redis"
+    prefix = "optocom:response:"
+
+    def __init__(self, url, ttl=RESPONSE_CACHE_TTL, timeout=RESPONSE_CACHE_TIMEOUT):
+        try:
+            redis = importlib.import_module("redis")
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE_URL needs the 'redis' package installed on the server")
+        self.ttl = ttl
+        # a slow or hung server fails the call instead of holding up the request
+        self._client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, body):
+        self._client.set(self.prefix + key, body, ex=self.ttl)
+
+    def clear(self):
+        keys = list(self._client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self._client.delete(*keys)
+
+    def stats(self):
+        return {"used_memory": self._client.info("memory").get("used_memory"), "ttl": self.ttl}
+
+
+class ResponseCache:
+    #encoded responses keyed by user, data version, endpoint and parameters
+    #a write bumps the user's version, so stale entries are simply never asked for again
+    #a backend that fails (redis down) is counted and skipped - the response is computed as if uncached
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = Counter()
+        self.misses = Counter()
+        self.errors = Counter()
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def fetch(self, key, endpoint, compute):
+        #cached bytes for a cache_key(), compute() encodes them on a miss
+        if self.backend is None:
+            return compute()
+
+        try:
+            body = self.backend.get(key)
+        except Exception as e:
+            self._backend_failed(endpoint, e)
+            return compute()
+
+        with self._lock:
+            (self.misses if body is None else self.hits)[endpoint] += 1
+        if body is None:
+            body = compute()
+            try:
+                self.backend.set(key, body)
+            except Exception as e:
+                self._backend_failed(endpoint, e)
+        return body
+
+    def _backend_failed(self, endpoint, error):
+        message = f"{type(error).__name__}: {error}"
+        with self._lock:
+            self.errors[endpoint] += 1
+            repeated, self.last_error = message == self.last_error, message
+        if not repeated:
+            print(f"⚠️ Response cache {self.backend.name} failed, serving uncached: {message}")
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    "hits": self.hits[endpoint],
+                    "misses": self.misses[endpoint],
+                    "errors": self.errors[endpoint],
+                    "hit_rate": hit_rate(self.hits[endpoint], self.misses[endpoint]),
+                }
+                for endpoint in sorted(set(self.hits) | set(self.misses) | set(self.errors))
+            }
+            hits, misses, errors = sum(self.hits.values()), sum(self.misses.values()), sum(self.errors.values())
+            last_error = self.last_error
+
+        backend = {}
+        if self.backend is not None:
+            try:
+                backend = self.backend.stats()
+            except Exception as e:
+                backend = {"unavailable": f"{type(e).__name__}: {e}"}
+        return {
+            "backend": self.backend.name if self.backend else None,
+            **backend,
+            "hits": hits,
+            "misses": misses,
+            "errors": errors,
+            "last_error": last_error,
+            "hit_rate": hit_rate(hits, misses),
+            "endpoints": endpoints,
+        }
+
+
+def hit_rate(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else 0.0
+
+
+def make_response_cache():
+    #backend from the environment: shared redis, per-process memory, or off
+    if RESPONSE_CACHE_URL:
+        try:
+            return ResponseCache(RedisBackend(RESPONSE_CACHE_URL))
+        except Exception as e:
+            print(f"❌ Shared response cache unavailable, using per-process memory: {e}")
+    if RESPONSE_CACHE_MB > 0:
+        return ResponseCache(MemoryBackend(int(RESPONSE_CACHE_MB * 1024 * 1024)))
+    return ResponseCache()
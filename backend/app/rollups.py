@@ -0,0 +1,65 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import Date, func, insert, literal, null, select
+from sqlalchemy.orm import Session
+
+from database import DailyTotal, Past, Patient
+
+# rollup kind -> (raw table, actual spend column, probability column)
+ROLLUP_SOURCES = {
+    "upcoming": (Patient, None, Patient.purchase_probability),
+    "past": (Past, Past.amount_spent, None),
+}
+
+
+def refresh_daily_totals(db: Session, user_id=None, kind=None, days=None, batch_size=500):
+    #recompute rollup rows from the raw rows inside the caller's transaction
+    #user_id None = every user, kind None = both kinds, days None = every day, otherwise just those days
+    for rollup_kind in ([kind] if kind else list(ROLLUP_SOURCES)):
+        if days is None:
+            _refresh(db, user_id, rollup_kind, None)
+            continue
+        days = sorted(days)
+        for start in range(0, len(days), batch_size):
+            _refresh(db, user_id, rollup_kind, days[start:start + batch_size])
+
+
+def _refresh(db, user_id, kind, days):
+    model, actual_column, probability_column = ROLLUP_SOURCES[kind]
+    day = func.date(model.appointment_date, type_=Date)
+
+    stale = db.query(DailyTotal).filter(DailyTotal.kind == kind)
+    if user_id is not None:
+        stale = stale.filter(DailyTotal.user_id == user_id)
+    if days is not None:
+        stale = stale.filter(DailyTotal.day.in_(days))
+    stale.delete(synchronize_session=False)
+
+    source = select(
+        model.user_id, literal(kind), day, func.count(),
+        func.sum(model.predicted_spend),
+        func.sum(actual_column) if actual_column is not None else null(),
+        func.avg(probability_column) if probability_column is not None else null(),
+    )
+    if user_id is not None:
+        source = source.where(model.user_id == user_id)
+    if days is not None:
+        # the range keeps the (user_id, appointment_date) index in play, the IN picks the exact days
+        source = source.where(
+            model.appointment_date >= datetime.combine(days[0], time.min),
+            model.appointment_date < datetime.combine(days[-1] + timedelta(days=1), time.min),
+            day.in_(days)
+        )
+    source = source.group_by(model.user_id, day)
+
+    db.execute(insert(DailyTotal).from_select(
+        ["user_id", "kind", "day", "appointments", "predicted_spend", "actual_spend", "mean_probability"],
+        source
+    ))
+
+
+def clear_daily_totals(db: Session, user_id: int, kind=None):
+    query = db.query(DailyTotal).filter(DailyTotal.user_id == user_id)
+    if kind is not None:
+        query = query.filter(DailyTotal.kind == kind)
+    return query.delete(synchronize_session=False)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 
@@ -76,10 +76,12 @@ class PatientResponse(BaseModel):
     appointment_date: datetime
     predicted_spend: float
     purchase_probability: float
+    model_version: Optional[str] = None
     created_at: datetime
 
     class Config:
         from_attributes = True
+        protected_namespaces = ()  # model_version is the prediction's model, not a pydantic attribute
 
 
 class WeeklySalesResponse(BaseModel):
@@ -115,6 +117,13 @@ class PastAppointmentResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+class PastAppointmentPage(BaseModel):
+
+    items: List[Dict[str, Any]]  # PastAppointmentResponse fields, or just the ones asked for with ?fields=
+    next_cursor: Optional[str] = None  # pass back as ?cursor= for the next page, None on the last page
+    limit: int
+
 # legacy schemas
 
 class PatientInput(BaseModel):
@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "16"))  # waiting jobs, beyond this submit is refused
+UPLOAD_JOB_HISTORY = int(os.getenv("UPLOAD_JOB_HISTORY", "500"))  # finished jobs kept for polling
+
+
+class QueueFull(Exception):
+    pass
+
+
+class UploadLocks:
+    #one upload per (user, kind) at a time in this process, shared by request threads and job workers
+    #single_writer puts every upload behind one lock - sqlite only runs one write transaction at a time anyway
+
+    def __init__(self, single_writer=False):
+        self.single_writer = single_writer
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def __call__(self, user_id, kind):
+        key = None if self.single_writer else (user_id, kind)
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+class UploadJob:
+    #one background upload, counters are bumped by the ingest functions as chunks go through
+
+    def __init__(self, user_id, kind, mode, filename):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.kind = kind
+        self.mode = mode
+        self.filename = filename
+        self.status = "queued"
+        self.rows = {"parsed": 0, "scored": 0, "written": 0}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def advance(self, stage, count):
+        with self._lock:
+            self.rows[stage] += count
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        with self._lock:
+            rows = dict(self.rows)
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "mode": self.mode,
+            "filename": self.filename,
+            "status": self.status,
+            "rows_parsed": rows["parsed"],
+            "rows_scored": rows["scored"],
+            "rows_written": rows["written"],
+            "seconds": round(elapsed, 3) if elapsed is not None else None,
+            "rows_per_second": round(rows["parsed"] / elapsed) if elapsed else None,
+            "queued_seconds": round((self.started_at or time.time()) - self.created_at, 3),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class UploadJobQueue:
+    #in-process bounded queue drained by a fixed pool of worker threads
+
+    def __init__(self, workers=UPLOAD_WORKERS, max_queued=UPLOAD_QUEUE_SIZE, history=UPLOAD_JOB_HISTORY):
+        self.workers = workers
+        self.history = history
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"upload-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job, run, discard=None):
+        #run(job) does the work and returns the result summary, discard() cleans up if the job never runs
+        self.start()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        try:
+            self._queue.put_nowait((job, run))
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            if discard:
+                discard()
+            raise QueueFull(f"{self._queue.qsize()} uploads already waiting")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "max_queued": self._queue.maxsize,
+            **{status: statuses.count(status) for status in ("queued", "running", "done", "failed")},
+        }
+
+    def _trim(self):
+        # forget the oldest finished jobs, never ones still queued or running
+        excess = len(self._jobs) - self.history
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job, run = self._queue.get()
+            job.started_at = time.time()
+            job.status = "running"
+            try:
+                job.result = run(job)
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+                print(f"❌ Upload job {job.id} failed: {e}")
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
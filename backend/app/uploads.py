@@ -0,0 +1,543 @@
+import gzip
+import hashlib
+import importlib
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, Date, DateTime, Index, Integer, MetaData, Table, and_, delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from database import Patient, Prediction, Past, Upload, delete_rows, insert_rows, update_rows
+from rollups import refresh_daily_totals
+from schemas import UpcomingAppointmentCSV, PastAppointmentCSV
+
+# rows parsed, scored and inserted per step - bounds memory whatever the file size
+CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "5000"))
+
+# patients hold their current prediction, the predictions table is an optional history log
+PREDICTION_HISTORY = os.getenv("PREDICTION_HISTORY", "1") == "1"
+
+YN_COLUMNS = ('employed', 'benefits', 'driver', 'vdu', 'varifocal', 'high_rx')
+FEATURE_FIELDS = ('age', 'days_lps') + YN_COLUMNS
+
+# longest suffix first
+UPLOAD_SUFFIXES = (
+    ('.csv.gz', 'csv.gz'), ('.csv.gzip', 'csv.gz'), ('.csv.zst', 'csv.zst'), ('.csv.zstd', 'csv.zst'),
+    ('.csv', 'csv'), ('.parquet', 'parquet'), ('.pq', 'parquet'),
+    ('.arrow', 'arrow'), ('.arrows', 'arrow'), ('.feather', 'arrow'), ('.ipc', 'arrow'),
+)
+UPLOAD_MAGIC = (
+    (b'\x1f\x8b', 'csv.gz'), (b'\x28\xb5\x2f\xfd', 'csv.zst'), (b'PAR1', 'parquet'), (b'ARROW1', 'arrow'),
+)
+
+
+def no_progress(stage, count):
+    pass
+
+
+def encode_features(age: int, days_lps: int, employed: bool, benefits: bool,
+                    driver: bool, vdu: bool, varifocal: bool, high_rx: bool) -> list:
+
+    # Convert to model format
+    employed_num = 1 if employed else 0
+    benefits_num = 0 if benefits else 1  # Note: inverted
+    driver_num = 1 if driver else 0
+    vdu_num = 1 if vdu else 0
+    varifocal_num = 1 if varifocal else 0
+    high_rx_num = 1 if high_rx else 0
+
+    return [age, days_lps, employed_num, benefits_num, driver_num, vdu_num, varifocal_num, high_rx_num]
+
+
+class CSVParseError(ValueError):
+    #bad values in an upload, each error is {"row": csv line number, "column": ..., "value": ...}
+    MAX_LISTED = 10
+
+    def __init__(self, errors, message=None):
+        self.errors = errors
+        self.message = message
+        super().__init__(str(self))
+
+    def __str__(self):
+        if self.message:
+            return self.message
+        listed = "; ".join(f"row {e['row']} {e['column']}: {e['value']!r}" for e in self.errors[:self.MAX_LISTED])
+        more = f" (+{len(self.errors) - self.MAX_LISTED} more)" if len(self.errors) > self.MAX_LISTED else ""
+        return f"{len(self.errors)} invalid value(s) - {listed}{more}"
+
+
+def schema_columns(schema):
+    #csv column -> python type, straight from the pydantic upload schema
+    return {name: field.annotation for name, field in schema.model_fields.items()}
+
+
+def parse_columns(frame, schema):
+    #typed numpy arrays for one chunk, CSVParseError listing every bad value
+    columns = {}
+    errors = []
+
+    for name, kind in schema_columns(schema).items():
+        column = frame[name]
+        if name == 'appointment_date':
+            if pd.api.types.is_datetime64_any_dtype(column):
+                values = column  # typed timestamps from parquet/arrow
+            elif pd.api.types.is_string_dtype(column):
+                values = pd.to_datetime(column.str.strip(), format='ISO8601', errors='coerce')
+            else:
+                values = pd.to_datetime(column, errors='coerce')  # arrow date32 and friends
+            if values.dt.tz is not None:
+                values = values.dt.tz_convert(None)
+            invalid = values.isna().to_numpy()
+            columns[name] = values.to_numpy(dtype='datetime64[us]')
+        elif name in YN_COLUMNS and pd.api.types.is_bool_dtype(column):
+            invalid = np.zeros(len(column), dtype=bool)
+            columns[name] = column.to_numpy(dtype=bool)
+        elif name in YN_COLUMNS:
+            # read as categories, so only the distinct spellings get normalised
+            if not isinstance(column.dtype, pd.CategoricalDtype):
+                column = column.astype(str).astype('category')
+            labels = column.cat.categories.str.strip().str.upper()
+            codes = column.cat.codes.to_numpy()
+            invalid = ~np.append(labels.isin(['Y', 'N']), False)[codes]
+            columns[name] = np.append(labels == 'Y', False)[codes]
+        else:
+            # the csv reader already typed clean numeric columns, only re-parse the rest
+            values = column if pd.api.types.is_numeric_dtype(column) else pd.to_numeric(column.str.strip(), errors='coerce')
+            invalid = values.isna().to_numpy()
+            if kind is int:
+                invalid = invalid | ((values != np.floor(values)).to_numpy() & ~invalid)
+                columns[name] = values.fillna(0).to_numpy(dtype=np.int64)
+            else:
+                columns[name] = values.to_numpy(dtype=np.float64)
+
+        if invalid.any():
+            # header is line 1, so data row i is line i + 2
+            for index, value in column[invalid].items():
+                errors.append({"row": int(index) + 2, "column": name, "value": str(value)})
+
+    if errors:
+        errors.sort(key=lambda e: e["row"])
+        raise CSVParseError(errors)
+
+    return columns
+
+
+def read_csv_columns(stream, schema, chunk_rows=CHUNK_ROWS):
+    #stream a binary csv as chunks of typed columns
+    wanted = list(schema_columns(schema))
+    dtypes = {name: 'category' for name in YN_COLUMNS}
+    dtypes['appointment_date'] = str
+    reader = pd.read_csv(stream, dtype=dtypes, keep_default_na=False, encoding='utf-8',
+                         usecols=lambda column: column in wanted, chunksize=chunk_rows)
+    with reader:
+        for frame in reader:
+            missing = [column for column in wanted if column not in frame.columns]
+            if missing:
+                raise CSVParseError([], f"Missing column(s): {', '.join(missing)}")
+            yield parse_columns(frame, schema)
+
+
+def read_arrow_columns(batches, schema, chunk_rows=CHUNK_ROWS):
+    #chunks of typed columns from arrow record batches, numeric/bool/timestamp columns skip text parsing
+    wanted = list(schema_columns(schema))
+    first = 0
+
+    for batch in batches:
+        missing = [column for column in wanted if column not in batch.schema.names]
+        if missing:
+            raise CSVParseError([], f"Missing column(s): {', '.join(missing)}")
+        batch = batch.select(wanted)
+
+        for start in range(0, batch.num_rows, chunk_rows):
+            frame = batch.slice(start, chunk_rows).to_pandas()
+            frame.index = pd.RangeIndex(first, first + len(frame))  # error rows numbered like the csv path
+            first += len(frame)
+            yield parse_columns(frame, schema)
+
+
+def optional_module(name, fmt):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise CSVParseError([], f"{fmt} uploads need the '{name.split('.')[0]}' package installed on the server")
+
+
+def upload_format(filename, head=b""):
+    #format from the file name, falling back to the magic bytes, None if unsupported
+    name = (filename or "").lower()
+    for suffix, fmt in UPLOAD_SUFFIXES:
+        if name.endswith(suffix):
+            return fmt
+    for magic, fmt in UPLOAD_MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return None
+
+
+def read_upload_columns(stream, schema, chunk_rows=CHUNK_ROWS, fmt="csv"):
+    #typed column chunks from any supported upload format, compressed csv is decompressed as it streams
+    if fmt == "csv":
+        return read_csv_columns(stream, schema, chunk_rows)
+    if fmt == "csv.gz":
+        return read_csv_columns(gzip.GzipFile(fileobj=stream, mode="rb"), schema, chunk_rows)
+    if fmt == "csv.zst":
+        zstandard = optional_module("zstandard", fmt)
+        return read_csv_columns(zstandard.ZstdDecompressor().stream_reader(stream), schema, chunk_rows)
+    if fmt == "parquet":
+        parquet = optional_module("pyarrow.parquet", fmt)
+        batches = parquet.ParquetFile(stream).iter_batches(batch_size=chunk_rows, columns=list(schema_columns(schema)))
+        return read_arrow_columns(batches, schema, chunk_rows)
+    if fmt == "arrow":
+        ipc = optional_module("pyarrow.ipc", fmt)
+        head = stream.read(6)
+        stream.seek(0)
+        if head == b"ARROW1":  # file format, otherwise the streaming format
+            reader = ipc.open_file(stream)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        else:
+            batches = ipc.open_stream(stream)
+        return read_arrow_columns(batches, schema, chunk_rows)
+    raise CSVParseError([], f"Unsupported upload format: {fmt}")
+
+
+def prediction_history(patient_ids, records):
+    #predictions table rows for records that already carry their scores
+    return [
+        {'patient_id': patient_id, 'purchase_probability': record['purchase_probability'],
+         'predicted_spend': record['predicted_spend']}
+        for patient_id, record in zip(patient_ids, records)
+    ]
+
+
+def column_features(columns):
+    #(n, 8) model features straight from the parsed arrays, same encoding as encode_features
+    return np.column_stack([
+        columns['age'], columns['days_lps'], columns['employed'], ~columns['benefits'],
+        columns['driver'], columns['vdu'], columns['varifocal'], columns['high_rx'],
+    ]).astype(float)
+
+
+def column_records(columns):
+    #row dicts of plain python values for the insert
+    fields = {
+        'patient_id': columns['id'].tolist(),
+        'appointment_date': columns['appointment_date'].tolist(),
+        **{name: columns[name].tolist() for name in FEATURE_FIELDS},
+    }
+    if 'amount_spent' in columns:
+        fields['amount_spent'] = columns['amount_spent'].tolist()
+
+    return [dict(zip(fields, values)) for values in zip(*fields.values())]
+
+
+def ingest_upcoming(db: Session, user_id: int, stream, score, chunk_rows=CHUNK_ROWS, progress=no_progress, fmt="csv",
+                    model_version=None) -> int:
+    #parse, score and insert one chunk at a time, caller commits
+    #progress(stage, rows) is told as each chunk is parsed, scored and written
+    total = 0
+
+    for columns in read_upload_columns(stream, UpcomingAppointmentCSV, chunk_rows, fmt):
+        progress("parsed", len(columns['id']))
+        probabilities, predicted_spends = score(column_features(columns))
+        progress("scored", len(columns['id']))
+
+        records = column_records(columns)
+        for record, probability, predicted_spend in zip(records, probabilities.tolist(), predicted_spends.tolist()):
+            record['user_id'] = user_id
+            record['purchase_probability'] = probability
+            record['predicted_spend'] = predicted_spend
+            record['model_version'] = model_version
+        patient_ids = insert_rows(db, Patient, records, return_ids=PREDICTION_HISTORY)
+        if PREDICTION_HISTORY:
+            insert_rows(db, Prediction, prediction_history(patient_ids, records))
+        progress("written", len(records))
+        total += len(records)
+
+    refresh_daily_totals(db, user_id, "upcoming")
+    return total
+
+
+def ingest_past(db: Session, user_id: int, stream, score, chunk_rows=CHUNK_ROWS, progress=no_progress, fmt="csv") -> int:
+    total = 0
+
+    for columns in read_upload_columns(stream, PastAppointmentCSV, chunk_rows, fmt):
+        progress("parsed", len(columns['id']))
+        probabilities, predicted_spends = score(column_features(columns))
+        progress("scored", len(columns['id']))
+
+        records = column_records(columns)
+        for record, predicted_spend in zip(records, predicted_spends.tolist()):
+            record['user_id'] = user_id
+            record['predicted_spend'] = predicted_spend
+        insert_rows(db, Past, records)
+        progress("written", len(records))
+        total += len(records)
+
+    refresh_daily_totals(db, user_id, "past")
+    return total
+
+
+# upsert uploads - the file is the new state, keyed on (csv id, appointment_date)
+# the file's keys go into a temp table chunk by chunk, so lookups and deletes are joins
+# and memory stays bounded by the chunk size however large the file or the stored history
+
+upload_keys = Table(
+    "upload_keys", MetaData(),
+    Column("user_id", Integer, nullable=False),
+    Column("patient_id", Integer, nullable=False),
+    Column("appointment_date", DateTime, nullable=False),
+    Column("chunk", Integer, nullable=False),
+    Column("line", Integer, nullable=False),  # row number in the file, for error messages
+    Index("ix_upload_keys_key", "patient_id", "appointment_date"),
+    Index("ix_upload_keys_chunk", "chunk"),
+    prefixes=["TEMPORARY"],
+)
+
+
+def create_upload_keys(db: Session):
+    #fresh temp table on the session's connection, one left by a failed sync is dropped first
+    upload_keys.drop(db.connection(), checkfirst=True)
+    upload_keys.create(db.connection())
+
+
+def stage_keys(db: Session, user_id: int, records, chunk: int, first_row: int):
+    #add a chunk's keys to upload_keys, a key already in the file (this chunk or an earlier one) is an error
+    db.execute(insert(upload_keys), [
+        {"user_id": user_id, "patient_id": record['patient_id'], "appointment_date": record['appointment_date'],
+         "chunk": chunk, "line": first_row + i}
+        for i, record in enumerate(records)
+    ])
+
+    earlier = upload_keys.alias("earlier")
+    repeated = db.execute(
+        select(upload_keys.c.line, upload_keys.c.patient_id, upload_keys.c.appointment_date).distinct()
+        .join(earlier, and_(earlier.c.patient_id == upload_keys.c.patient_id,
+                            earlier.c.appointment_date == upload_keys.c.appointment_date,
+                            earlier.c.line < upload_keys.c.line))
+        .where(upload_keys.c.chunk == chunk)
+        .order_by(upload_keys.c.line)
+    ).all()
+    if repeated:
+        raise CSVParseError([{"row": line, "column": "id", "value": f"{patient_id} @ {appointment_date} repeated"}
+                             for line, patient_id, appointment_date in repeated])
+
+
+def stored_rows(db: Session, model, fields, chunk: int):
+    #(patient_id, appointment_date) -> (row id, field values) for the stored rows matching a staged chunk
+    #rows sharing a key (older replace uploads allow that) come back separately as extra ids
+    #user_id comes from the staged rows too, so the only way into the (user_id, appointment_date)
+    #index is probing it per staged key - the planner can't pick a scan of the user's whole history
+    query = (
+        select(model.id, model.patient_id, model.appointment_date, *(getattr(model, f) for f in fields))
+        .select_from(upload_keys)
+        .join(model, and_(model.user_id == upload_keys.c.user_id,
+                          model.appointment_date == upload_keys.c.appointment_date,
+                          model.patient_id == upload_keys.c.patient_id))
+        .where(upload_keys.c.chunk == chunk)
+        .order_by(model.id)
+    )
+    stored = {}
+    extra_ids = []
+    for row in db.execute(query):
+        key = (row[1], row[2])
+        if key in stored:
+            extra_ids.append(row[0])
+        else:
+            stored[key] = (row[0], tuple(row[3:]))
+    return stored, extra_ids
+
+
+def missing_from_upload(model, user_id: int):
+    #the user's rows whose key is not in upload_keys - anti-join, nothing loaded into python
+    in_upload = select(upload_keys.c.line).where(
+        upload_keys.c.patient_id == model.patient_id,
+        upload_keys.c.appointment_date == model.appointment_date
+    ).exists()
+    return and_(model.user_id == user_id, ~in_upload)
+
+
+def missing_days(db: Session, model, user_id: int):
+    day = func.date(model.appointment_date, type_=Date)
+    return set(db.execute(select(day).where(missing_from_upload(model, user_id)).distinct()).scalars())
+
+
+def diff_records(records, stored, fields):
+    #split a chunk into new rows, rows whose features changed and rows where only other fields changed
+    #matched records get their stored 'id'
+    inserted, rescored, updated = [], [], []
+    n_features = len(FEATURE_FIELDS)
+
+    for i, record in enumerate(records):
+        current = stored.get((record['patient_id'], record['appointment_date']))
+        if current is None:
+            inserted.append(i)
+            continue
+        row_id, old_values = current
+        new_values = tuple(record[f] for f in fields)
+        if new_values[:n_features] != old_values[:n_features]:
+            record['id'] = row_id
+            rescored.append(i)
+        elif new_values != old_values:
+            record['id'] = row_id
+            updated.append(i)
+
+    return inserted, rescored, updated
+
+
+def delete_patients(db: Session, condition) -> int:
+    #patients matching condition and their prediction history first - sqlite doesn't enforce the cascade
+    #and reuses freed ids, so leftover history would be credited to the next patients inserted
+    db.execute(delete(Prediction).where(Prediction.patient_id.in_(select(Patient.id).where(condition))))
+    return db.execute(delete(Patient).where(condition)).rowcount
+
+
+def sync_upcoming(db: Session, user_id: int, stream, score, chunk_rows=CHUNK_ROWS, progress=no_progress, fmt="csv",
+                  model_version=None) -> dict:
+    #insert new appointments, update and re-score changed ones, delete the ones missing from the file
+    #only new or changed rows are scored, caller commits
+    create_upload_keys(db)
+    touched_days = set()
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    first_row = 2
+
+    for chunk, columns in enumerate(read_upload_columns(stream, UpcomingAppointmentCSV, chunk_rows, fmt)):
+        records = column_records(columns)
+        progress("parsed", len(records))
+        stage_keys(db, user_id, records, chunk, first_row)
+        first_row += len(records)
+        stored, extra_ids = stored_rows(db, Patient, FEATURE_FIELDS, chunk)
+        inserted, rescored, _ = diff_records(records, stored, FEATURE_FIELDS)
+        changed = inserted + rescored
+        touched_days.update(records[i]['appointment_date'].date() for i in changed)
+
+        if extra_ids:
+            # second copies of a key from older replace uploads, on one of this chunk's days
+            delete_rows(db, Prediction, extra_ids, column=Prediction.patient_id)
+            counts["deleted"] += delete_rows(db, Patient, extra_ids)
+            touched_days.update(record['appointment_date'].date() for record in records)
+
+        if changed:
+            probabilities, predicted_spends = score(column_features(columns)[changed])
+            for i, probability, predicted_spend in zip(changed, probabilities.tolist(), predicted_spends.tolist()):
+                records[i]['purchase_probability'] = probability
+                records[i]['predicted_spend'] = predicted_spend
+                records[i]['model_version'] = model_version
+            progress("scored", len(changed))
+
+            new_records = [records[i] for i in inserted]
+            for record in new_records:
+                record['user_id'] = user_id
+            patient_ids = insert_rows(db, Patient, new_records, return_ids=PREDICTION_HISTORY)
+            update_rows(db, Patient, [records[i] for i in rescored])
+            if PREDICTION_HISTORY:
+                # re-scored rows get a new history entry, the old one stays
+                patient_ids += [records[i]['id'] for i in rescored]
+                insert_rows(db, Prediction, prediction_history(patient_ids, new_records + [records[i] for i in rescored]))
+            progress("written", len(changed))
+
+        counts["inserted"] += len(inserted)
+        counts["updated"] += len(rescored)
+        counts["unchanged"] += len(records) - len(changed)
+
+    missing = missing_from_upload(Patient, user_id)
+    touched_days.update(missing_days(db, Patient, user_id))
+    counts["deleted"] += delete_patients(db, missing)
+    upload_keys.drop(db.connection())
+
+    # rollup rows only for the days this upload changed
+    refresh_daily_totals(db, user_id, "upcoming", touched_days)
+
+    return counts
+
+
+def sync_past(db: Session, user_id: int, stream, score, chunk_rows=CHUNK_ROWS, progress=no_progress, fmt="csv") -> dict:
+    #same as sync_upcoming, an amount_spent-only change updates the row without re-scoring it
+    fields = FEATURE_FIELDS + ('amount_spent',)
+    create_upload_keys(db)
+    touched_days = set()
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    first_row = 2
+
+    for chunk, columns in enumerate(read_upload_columns(stream, PastAppointmentCSV, chunk_rows, fmt)):
+        records = column_records(columns)
+        progress("parsed", len(records))
+        stage_keys(db, user_id, records, chunk, first_row)
+        first_row += len(records)
+        stored, extra_ids = stored_rows(db, Past, fields, chunk)
+        inserted, rescored, updated = diff_records(records, stored, fields)
+        changed = inserted + rescored
+        touched_days.update(records[i]['appointment_date'].date() for i in changed + updated)
+
+        if extra_ids:
+            counts["deleted"] += delete_rows(db, Past, extra_ids)
+            touched_days.update(record['appointment_date'].date() for record in records)
+
+        if changed:
+            _, predicted_spends = score(column_features(columns)[changed])
+            for i, predicted_spend in zip(changed, predicted_spends.tolist()):
+                records[i]['predicted_spend'] = predicted_spend
+            progress("scored", len(changed))
+
+        new_records = [records[i] for i in inserted]
+        for record in new_records:
+            record['user_id'] = user_id
+        insert_rows(db, Past, new_records)
+        update_rows(db, Past, [records[i] for i in rescored + updated])
+        progress("written", len(changed) + len(updated))
+
+        counts["inserted"] += len(inserted)
+        counts["updated"] += len(rescored) + len(updated)
+        counts["unchanged"] += len(records) - len(changed) - len(updated)
+
+    missing = missing_from_upload(Past, user_id)
+    touched_days.update(missing_days(db, Past, user_id))
+    counts["deleted"] += db.execute(delete(Past).where(missing)).rowcount
+    upload_keys.drop(db.connection())
+    refresh_daily_totals(db, user_id, "past", touched_days)
+
+    return counts
+
+
+# content-hash dedup
+
+def content_hash(stream, block_size=1024 * 1024):
+    #sha256 of the raw upload bytes, stream is rewound afterwards
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(block_size), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def previous_upload(db: Session, user_id: int, kind: str, upload_hash: str, model_version: str):
+    #stored result of the user's last upload of this kind when it was these exact bytes scored by this model
+    record = db.query(Upload).filter(
+        Upload.user_id == user_id,
+        Upload.kind == kind,
+        Upload.content_hash == upload_hash,
+        Upload.model_version == model_version
+    ).first()
+    return json.loads(record.result) if record else None
+
+
+def remember_upload(db: Session, user_id: int, kind: str, upload_hash: str, model_version: str, result: dict):
+    #replaces the previous record, caller commits it with the data it describes
+    record = db.query(Upload).filter(Upload.user_id == user_id, Upload.kind == kind).first()
+    if record is None:
+        record = Upload(user_id=user_id, kind=kind)
+        db.add(record)
+    record.content_hash = upload_hash
+    record.model_version = model_version
+    record.result = json.dumps(result)
+    record.created_at = datetime.now(timezone.utc)
+
+
+def forget_uploads(db: Session, user_id: int, kind=None):
+    #after any other change to the user's data the next upload has to be processed again
+    query = db.query(Upload).filter(Upload.user_id == user_id)
+    if kind is not None:
+        query = query.filter(Upload.kind == kind)
+    return query.delete(synchronize_session=False)
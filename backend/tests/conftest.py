@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+APP_DIR = Path(__file__).resolve().parents[1] / "app"
+
+# the app modules import each other flat (from database import ...), as when run from backend/app
+sys.path.insert(0, str(APP_DIR))
+
+# settings are read at import - a throwaway database (TEST_DATABASE_URL to use another) and model directory
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+os.environ["MODEL_PATH"] = tempfile.mkdtemp()
+os.environ["RESPONSE_CACHE_MB"] = "64"  # the per-process response cache, whatever the shell has set
+os.environ.pop("RESPONSE_CACHE_URL", None)
+os.environ["UPLOAD_CHUNK_ROWS"] = "100"  # small chunks, so test uploads cross chunk boundaries
+
+
+@pytest.fixture(scope="session")
+def client():
+    #app with its startup run and the models loaded, shared by the whole session
+    from fastapi.testclient import TestClient
+    import main
+
+    cwd = os.getcwd()
+    os.chdir(APP_DIR)  # training data and static files are relative to backend/app
+    with TestClient(main.app) as client:
+        deadline = time.monotonic() + 120
+        while client.get("/ready").status_code != 200:
+            assert main.model_state["status"] != "failed", main.model_state["error"]
+            assert time.monotonic() < deadline, "models did not load"
+            time.sleep(0.1)
+        yield client
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def new_user(client):
+    #registers a fresh user and returns its auth headers, so tests don't see each other's rows
+    def register():
+        name = f"user-{uuid.uuid4().hex[:12]}"
+        client.post("/register", json={"username": name, "email": f"{name}@example.com", "password": "pw",
+                                       "practice_name": "Test Practice"})
+        token = client.post("/login", json={"username": name, "password": "pw"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    return register
+
+
+@pytest.fixture
+def auth_headers(new_user):
+    return new_user()
@@ -0,0 +1,56 @@
+import threading
+
+from sqlalchemy import func, select
+
+from database import Past, Patient, SessionLocal
+from demo_csv_generator import get_demo_past_csv, get_demo_upcoming_csv
+
+
+def first_rows(text, rows):
+    lines = text.splitlines(keepends=True)
+    return "".join(lines[:rows + 1])
+
+
+def upload_together(client, headers, uploads):
+    #start every (kind, csv) upload at the same moment from its own thread, returns the responses in order
+    barrier = threading.Barrier(len(uploads))
+    responses = [None] * len(uploads)
+
+    def post(i, kind, text):
+        barrier.wait()
+        responses[i] = client.post(f"/upload/{kind}", headers=headers, files={"file": (f"{kind}.csv", text)})
+
+    threads = [threading.Thread(target=post, args=(i, kind, text)) for i, (kind, text) in enumerate(uploads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def stored_count(client, headers, model):
+    user_id = client.get("/me", headers=headers).json()["id"]
+    with SessionLocal() as db:
+        return db.execute(select(func.count()).select_from(model).where(model.user_id == user_id)).scalar()
+
+
+def test_concurrent_replace_uploads_leave_one_file(client, auth_headers):
+    upcoming, _ = get_demo_upcoming_csv()
+    small = first_rows(upcoming, 50)
+
+    responses = upload_together(client, auth_headers, [("upcoming", upcoming), ("upcoming", small)])
+
+    assert [r.status_code for r in responses] == [200, 200], [r.json() for r in responses]
+    counts = [r.json()["details"]["patients"] for r in responses]
+    assert stored_count(client, auth_headers, Patient) in counts
+
+
+def test_concurrent_past_and_upcoming_uploads(client, auth_headers):
+    upcoming, _ = get_demo_upcoming_csv()
+    past, _ = get_demo_past_csv()
+
+    responses = upload_together(client, auth_headers, [("upcoming", upcoming), ("past", past)])
+
+    assert [r.status_code for r in responses] == [200, 200], [r.json() for r in responses]
+    assert stored_count(client, auth_headers, Patient) == responses[0].json()["details"]["patients"]
+    assert stored_count(client, auth_headers, Past) == responses[1].json()["details"]["records"]
@@ -0,0 +1,42 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from models.forest_classifier import FlatForest, Forest
+
+
+def random_features(rng, rows):
+    #age, days_lps and the six Y/N flags, like encode_features produces
+    return np.column_stack([
+        rng.integers(18, 91, rows),
+        rng.integers(0, 1461, rows),
+        rng.integers(0, 2, (rows, 6)),
+    ]).astype(float)
+
+
+def fitted_forest(rng):
+    x = random_features(rng, 2000)
+    y = ((x[:, 0] > 50) ^ (x[:, 1] < 400) ^ (x[:, 2] == 1) | (rng.random(len(x)) < 0.1)).astype(int)
+    return RandomForestClassifier(n_estimators=25, random_state=0).fit(x, y)
+
+
+def test_flat_forest_matches_predict_proba():
+    rng = np.random.default_rng(42)
+    rf = fitted_forest(rng)
+    x = random_features(rng, 1000)
+
+    flat = FlatForest.from_sklearn(rf).predict_proba(x)
+
+    np.testing.assert_allclose(flat, rf.predict_proba(x)[:, 1], rtol=0, atol=1e-12)
+
+
+def test_probability_cal_uses_flat_path_for_single_rows():
+    rng = np.random.default_rng(7)
+    forest = Forest()
+    forest.model = fitted_forest(rng)
+    forest.compile()
+
+    for row in random_features(rng, 50):
+        probability, percentage = forest.probability_cal([row])
+        expected = forest.model.predict_proba([row])[0][1]
+        assert abs(probability - expected) < 1e-12
+        assert abs(percentage - expected * 100) < 1e-9
@@ -0,0 +1,44 @@
+import numpy as np
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import StandardScaler
+
+from models.linear_classifier import Linear
+
+
+def fitted_linear(rng):
+    #spend falls with age so old patients with few flags predict below zero and hit the clamp
+    x = np.column_stack([rng.integers(18, 91, 2000), rng.integers(0, 1461, 2000),
+                         rng.integers(0, 2, (2000, 6))]).astype(float)
+    y = 400 - 6 * x[:, 0] + 0.05 * x[:, 1] + x[:, 2:] @ np.array([30, -20, 15, 10, 60, 45]) + rng.normal(0, 20, 2000)
+
+    linear = Linear()
+    linear.scaler = StandardScaler().fit(x)
+    linear.model = LinearRegression().fit(linear.scaler.transform(x), y)
+    linear.fold_scaler()
+    return linear
+
+
+def sklearn_spend(linear, x):
+    return np.maximum(0, linear.model.predict(linear.scaler.transform(x)))
+
+
+def test_folded_batch_matches_scaler_and_model():
+    rng = np.random.default_rng(3)
+    linear = fitted_linear(rng)
+    x = np.column_stack([rng.integers(18, 91, 1000), rng.integers(0, 1461, 1000),
+                         rng.integers(0, 2, (1000, 6))]).astype(float)
+
+    expected = sklearn_spend(linear, x)
+    assert (expected == 0).sum() > 0  # some rows go through the clamp
+    np.testing.assert_allclose(linear.predict_spending_batch(x, linear.scaler), expected, rtol=0, atol=1e-9)
+
+
+def test_folded_single_row_matches_scaler_and_model():
+    rng = np.random.default_rng(4)
+    linear = fitted_linear(rng)
+    rows = [[85, 1400, 0, 0, 0, 0, 0, 0], [20, 0, 1, 0, 1, 1, 1, 1], [55, 700, 1, 1, 0, 1, 0, 1]]
+
+    for row in rows:
+        expected = sklearn_spend(linear, [row])[0]
+        assert abs(linear.predict_spending(row, linear.scaler) - expected) < 1e-9
+    assert linear.predict_spending(rows[0], linear.scaler) == 0
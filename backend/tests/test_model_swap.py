@@ -0,0 +1,42 @@
+import copy
+
+from sqlalchemy import select
+
+from database import Patient, SessionLocal, Upload
+from demo_csv_generator import get_demo_upcoming_csv
+from models.model_store import ModelBundle
+
+
+def test_upload_keeps_its_model_bundle_through_a_swap(client, auth_headers, monkeypatch):
+    import main
+
+    started = main.active_models
+    swapped = ModelBundle(copy.copy(started.forest), started.linear)
+    swapped.forest.version = f"{started.version}-swapped"
+    monkeypatch.setattr(main, "active_models", started)  # put back after the test
+
+    # the first chunk scored swaps the active bundle, as a reload finishing mid-upload would
+    scored_with = []
+
+    def score_and_swap(models, features):
+        scored_with.append(models.version)
+        main.active_models = swapped
+        return score_features(models, features)
+
+    score_features = main.score_features
+    monkeypatch.setattr(main, "score_features", score_and_swap)
+    main.prediction_cache.clear()
+
+    upcoming, _ = get_demo_upcoming_csv()
+    response = client.post("/upload/upcoming", headers=auth_headers, files={"file": ("upcoming.csv", upcoming)})
+    assert response.status_code == 200, response.json()
+
+    user_id = client.get("/me", headers=auth_headers).json()["id"]
+    with SessionLocal() as db:
+        stamped = set(db.execute(select(Patient.model_version).where(Patient.user_id == user_id)).scalars())
+        remembered = db.execute(select(Upload.model_version).where(Upload.user_id == user_id)).scalar()
+
+    assert len(scored_with) > 1  # several chunks, the later ones after the swap
+    assert set(scored_with) == {started.version}
+    assert stamped == {started.version}
+    assert remembered == started.version
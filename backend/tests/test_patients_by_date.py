@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from database import engine
+from demo_csv_generator import get_demo_upcoming_csv
+
+
+@contextmanager
+def counted_statements():
+    #every statement the app sends to the database inside the block
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def upload_days(client, headers, days):
+    #upcoming csv with `count` demo patients booked on each (day, count), far from the demo's own dates
+    header, *rows = get_demo_upcoming_csv()[0].splitlines()
+    lines = [header]
+    for day, count in days:
+        for minute in range(count):
+            fields = rows.pop().split(",")
+            fields[-1] = f"{day} 09:{minute:02d}:00"
+            lines.append(",".join(fields))
+    response = client.post("/upload/upcoming", headers=headers, files={"file": ("upcoming.csv", "\n".join(lines))})
+    assert response.status_code == 200, response.json()
+
+
+def test_patients_by_date_statements_do_not_grow_with_patients(client, auth_headers):
+    upload_days(client, auth_headers, [("2030-01-01", 1), ("2030-01-02", 40)])
+
+    for day, count in (("2030-01-01", 1), ("2030-01-02", 40)):
+        with counted_statements() as statements:
+            response = client.get(f"/patients/date/{day}", headers=auth_headers)
+
+        assert response.status_code == 200
+        assert len(response.json()) == count
+        # the user's data version for the cache key, then one select of the day's patients
+        assert len(statements) == 2, statements
+        assert "data_version" in statements[0]
+        assert statements[1].lstrip().upper().startswith("SELECT") and "patients" in statements[1]
+
+
+def test_patients_by_date_cached_answer_only_reads_the_version(client, auth_headers):
+    upload_days(client, auth_headers, [("2030-01-03", 5)])
+    client.get("/patients/date/2030-01-03", headers=auth_headers)
+
+    with counted_statements() as statements:
+        response = client.get("/patients/date/2030-01-03", headers=auth_headers)
+
+    assert len(response.json()) == 5
+    assert len(statements) == 1 and "data_version" in statements[0], statements
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+
+def feature_rows(rng, rows, distinct):
+    #encoded rows drawn from `distinct` different patients, so most of them repeat
+    patients = np.column_stack([rng.integers(18, 91, distinct), rng.integers(0, 1461, distinct),
+                                rng.integers(0, 2, (distinct, 6))]).astype(float)
+    return patients[rng.integers(0, distinct, rows)]
+
+
+@pytest.mark.parametrize("batch_max", [0, 10_000])
+def test_predict_for_patients_matches_scoring_every_row(client, monkeypatch, batch_max):
+    import main
+
+    monkeypatch.setattr(main, "PREDICTION_CACHE_BATCH_MAX", batch_max)
+    main.prediction_cache.clear()
+    features = feature_rows(np.random.default_rng(7), 500, 40)
+
+    probabilities, predicted_spends = main.predict_for_patients(features, main.active_models)
+    expected_probabilities, expected_spends = main.score_features(main.active_models, features)
+
+    np.testing.assert_allclose(probabilities, expected_probabilities, atol=1e-12)
+    np.testing.assert_allclose(predicted_spends, expected_spends, atol=1e-9)
+
+
+def test_small_batches_use_the_cache_and_large_ones_skip_it(client, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "PREDICTION_CACHE_BATCH_MAX", 50)
+    main.prediction_cache.clear()
+    rng = np.random.default_rng(11)
+
+    small = feature_rows(rng, 200, 30)
+    main.predict_for_patients(small)
+    first = main.prediction_cache.stats()
+    main.predict_for_patients(small)
+    second = main.prediction_cache.stats()
+    distinct = len(np.unique(small, axis=0))
+    assert first["size"] == distinct
+    assert second["hits"] - first["hits"] == distinct  # one lookup per distinct row, not per row
+
+    main.predict_for_patients(feature_rows(rng, 200, 100))
+    assert main.prediction_cache.stats() == second
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from database import Patient, Prediction, SessionLocal, engine
+from demo_csv_generator import get_demo_upcoming_csv
+from migrations import backfill_patient_predictions
+
+
+def upload_upcoming(client, headers):
+    upcoming, _ = get_demo_upcoming_csv()
+    response = client.post("/upload/upcoming", headers=headers, files={"file": ("upcoming.csv", upcoming)})
+    assert response.status_code == 200, response.json()
+
+
+def user_id_of(client, headers):
+    return client.get("/me", headers=headers).json()["id"]
+
+
+def test_replace_upload_drops_the_old_patients_history(client, auth_headers):
+    upload_upcoming(client, auth_headers)
+    upload_upcoming(client, auth_headers)
+    user_id = user_id_of(client, auth_headers)
+
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(Patient.id, Patient.purchase_probability, Patient.predicted_spend,
+                   Prediction.purchase_probability, Prediction.predicted_spend)
+            .join(Prediction, Prediction.patient_id == Patient.id)
+            .where(Patient.user_id == user_id)
+        ).all()
+        patients = db.execute(select(func.count()).select_from(Patient).where(Patient.user_id == user_id)).scalar()
+
+    # one history row per patient, the one made for that patient's features
+    assert len(rows) == patients
+    assert len({row[0] for row in rows}) == patients
+    assert all(row[1:3] == row[3:5] for row in rows)
+
+
+def test_clear_data_drops_prediction_history(client, auth_headers):
+    upload_upcoming(client, auth_headers)
+    user_id = user_id_of(client, auth_headers)
+    with SessionLocal() as db:
+        patient_ids = list(db.execute(select(Patient.id).where(Patient.user_id == user_id)).scalars())
+
+    assert client.delete("/data/clear", headers=auth_headers).status_code == 200
+
+    with SessionLocal() as db:
+        left = db.execute(select(func.count()).select_from(Prediction)
+                          .where(Prediction.patient_id.in_(patient_ids))).scalar()
+    assert left == 0
+
+
+def test_backfill_copies_the_newest_prediction(client, auth_headers):
+    user_id = user_id_of(client, auth_headers)
+    with SessionLocal() as db:
+        patient = Patient(patient_id=1, user_id=user_id, age=40, days_lps=100, employed=True, benefits=False,
+                          driver=True, vdu=False, varifocal=False, high_rx=False,
+                          appointment_date=datetime(2030, 3, 1, 9, 0))
+        db.add(patient)
+        db.flush()
+        db.add_all([Prediction(patient_id=patient.id, purchase_probability=0.1, predicted_spend=10.0),
+                    Prediction(patient_id=patient.id, purchase_probability=0.9, predicted_spend=90.0)])
+        db.commit()
+        patient_id = patient.id
+
+    with engine.begin() as connection:
+        backfill_patient_predictions(connection)
+
+    with SessionLocal() as db:
+        current = db.execute(select(Patient.purchase_probability, Patient.predicted_spend)
+                             .where(Patient.id == patient_id)).one()
+    assert tuple(current) == (0.9, 90.0)
@@ -0,0 +1,71 @@
+import pytest
+
+from response_cache import MemoryBackend, ResponseCache
+
+
+class DownBackend:
+    #a shared backend whose server has gone away - every call fails like a refused redis connection
+
+    name = "redis"
+
+    def get(self, key):
+        raise ConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+
+    def set(self, key, body):
+        raise ConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+
+    def clear(self):
+        raise ConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+
+    def stats(self):
+        raise ConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+
+
+class ReadOnlyBackend(MemoryBackend):
+    #reads work, writes fail (e.g. the server is out of memory)
+
+    def set(self, key, body):
+        raise ConnectionError("OOM command not allowed when used memory > 'maxmemory'.")
+
+
+def test_fetch_computes_when_backend_is_down():
+    cache = ResponseCache(DownBackend())
+
+    assert cache.fetch("k", "patients_by_date", lambda: b"[]") == b"[]"
+    assert cache.fetch("k", "patients_by_date", lambda: b"[1]") == b"[1]"
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["errors"]) == (0, 0, 2)
+    assert stats["endpoints"]["patients_by_date"] == {"hits": 0, "misses": 0, "errors": 2, "hit_rate": 0.0}
+    assert "Connection refused" in stats["last_error"]
+    assert "Connection refused" in stats["unavailable"]
+
+
+def test_fetch_returns_body_when_backend_write_fails():
+    cache = ResponseCache(ReadOnlyBackend(1024))
+
+    assert cache.fetch("k", "analytics_weekly", lambda: b"{}") == b"{}"
+
+    stats = cache.stats()
+    assert (stats["misses"], stats["errors"]) == (1, 1)
+
+
+def test_endpoint_serves_uncached_when_backend_is_down(client, auth_headers, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.response_cache, "backend", DownBackend())
+
+    response = client.get("/patients/date/2030-02-01", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json() == []
+    assert client.get("/debug/response-cache").json()["errors"] >= 1
+
+
+@pytest.mark.parametrize("endpoint", ["/analytics/weekly?start_date=2030-02-01", "/analytics/monthly?month=2030-02"])
+def test_analytics_serve_uncached_when_backend_is_down(client, auth_headers, monkeypatch, endpoint):
+    import main
+
+    monkeypatch.setattr(main.response_cache, "backend", DownBackend())
+
+    assert client.get(endpoint, headers=auth_headers).status_code == 200
@@ -0,0 +1,12 @@
+import subprocess
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parents[1] / "app"
+
+
+def test_schemas_import_without_warnings():
+    #fresh interpreter, so the models are built here - the session has long since imported them
+    result = subprocess.run([sys.executable, "-W", "error::UserWarning", "-c", "import schemas"],
+                            cwd=APP_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
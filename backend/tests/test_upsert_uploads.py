@@ -0,0 +1,188 @@
+import csv
+import io
+from collections import defaultdict
+
+import pytest
+from sqlalchemy import func, select
+
+from database import DailyTotal, Past, Patient, Prediction, SessionLocal
+from demo_csv_generator import get_demo_past_csv, get_demo_upcoming_csv
+
+FEATURES = ("age", "days_lps", "employed", "benefits", "driver", "vdu", "varifocal", "high_rx")
+MODELS = {"past": Past, "upcoming": Patient}
+DEMO = {"past": get_demo_past_csv, "upcoming": get_demo_upcoming_csv}
+
+
+def read_rows(text):
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def write_rows(rows):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def upload(client, headers, kind, rows, mode="upsert"):
+    return client.post(f"/upload/{kind}?mode={mode}", headers=headers, files={"file": (f"{kind}.csv", write_rows(rows))})
+
+
+def user_id_of(client, headers):
+    return client.get("/me", headers=headers).json()["id"]
+
+
+def stored(kind, user_id):
+    #(csv id, appointment_date) -> list of stored rows, so duplicates show up
+    model = MODELS[kind]
+    columns = [getattr(model, f) for f in FEATURES] + [model.predicted_spend]
+    columns.append(model.amount_spent if kind == "past" else model.purchase_probability)
+    rows = defaultdict(list)
+    with SessionLocal() as db:
+        for row in db.execute(select(model.patient_id, model.appointment_date, *columns)
+                              .where(model.user_id == user_id)):
+            rows[(row[0], row[1])].append(tuple(row[2:]))
+    return rows
+
+
+def daily_totals(kind, user_id):
+    with SessionLocal() as db:
+        return {
+            row.day: (row.appointments, row.predicted_spend, row.actual_spend, row.mean_probability)
+            for row in db.execute(select(DailyTotal).where(DailyTotal.user_id == user_id,
+                                                           DailyTotal.kind == kind)).scalars()
+        }
+
+
+def totals_from_rows(kind, rows):
+    #what daily_totals should hold for these stored rows
+    days = defaultdict(list)
+    for (_, appointment_date), copies in rows.items():
+        days[appointment_date.date()].extend(copies)
+    totals = {}
+    for day, day_rows in days.items():
+        predicted = sum(row[8] for row in day_rows)
+        if kind == "past":
+            totals[day] = (len(day_rows), predicted, sum(row[9] for row in day_rows), None)
+        else:
+            totals[day] = (len(day_rows), predicted, None, sum(row[9] for row in day_rows) / len(day_rows))
+    return totals
+
+
+def assert_totals_match(actual, expected):
+    assert actual.keys() == expected.keys()
+    for day, values in expected.items():
+        assert actual[day] == pytest.approx(values), day
+
+
+def edited(kind, rows):
+    #the demo file with one of each kind of change, spread over several 100-row chunks
+    rows = [dict(row) for row in rows]
+    rows[5]["age"] = str(int(rows[5]["age"]) + 7)  # re-scored
+    rows[250]["days_lps"] = str(int(rows[250]["days_lps"]) + 30)  # re-scored
+    if kind == "past":
+        rows[120]["amount_spent"] = "999.5"  # updated, not re-scored
+    del rows[340]  # deleted
+    del rows[-1]  # deleted - the only appointment on its day, so the day leaves daily_totals
+    new = dict(rows[10], id="999999", appointment_date="2030-05-01 10:00:00")
+    rows.insert(150, new)  # inserted, on a new day
+    return rows
+
+
+@pytest.mark.parametrize("kind", ["past", "upcoming"])
+def test_upsert_matches_a_replace_of_the_same_file(client, auth_headers, new_user, kind):
+    original = read_rows(DEMO[kind]()[0])
+    original.append(dict(original[0], id="888888", appointment_date="2030-04-01 09:00:00"))
+    user_id = user_id_of(client, auth_headers)
+    assert upload(client, auth_headers, kind, original, mode="replace").status_code == 200
+    before = stored(kind, user_id)
+
+    rows = edited(kind, original)
+    response = upload(client, auth_headers, kind, rows)
+
+    assert response.status_code == 200, response.json()
+    updated = 3 if kind == "past" else 2
+    assert response.json()["details"] == {"inserted": 1, "updated": updated, "deleted": 2,
+                                          "unchanged": len(rows) - 1 - updated}
+
+    after = stored(kind, user_id)
+    replace_headers = new_user()
+    assert upload(client, replace_headers, kind, rows, mode="replace").status_code == 200
+    replaced = stored(kind, user_id_of(client, replace_headers))
+
+    assert after.keys() == replaced.keys()
+    for key, copies in replaced.items():
+        assert after[key] == [pytest.approx(row) for row in copies], key
+    # untouched rows keep their stored values
+    edited_ids = {int(original[i]["id"]) for i in (5, 120, 250)}
+    for key, copies in after.items():
+        if key in before and key[0] not in edited_ids:
+            assert copies == before[key]
+
+    assert_totals_match(daily_totals(kind, user_id), totals_from_rows(kind, after))
+    assert_totals_match(daily_totals(kind, user_id), daily_totals(kind, user_id_of(client, replace_headers)))
+
+
+def test_upsert_upcoming_keeps_prediction_history(client, auth_headers):
+    rows = read_rows(get_demo_upcoming_csv()[0])
+    user_id = user_id_of(client, auth_headers)
+    assert upload(client, auth_headers, "upcoming", rows, mode="replace").status_code == 200
+    assert upload(client, auth_headers, "upcoming", edited("upcoming", rows)).status_code == 200
+
+    with SessionLocal() as db:
+        history = dict(db.execute(
+            select(Patient.patient_id, func.count(Prediction.id))
+            .join(Prediction, Prediction.patient_id == Patient.id)
+            .where(Patient.user_id == user_id)
+            .group_by(Patient.id, Patient.patient_id)
+        ).all())
+        patients = db.execute(select(func.count()).select_from(Patient).where(Patient.user_id == user_id)).scalar()
+
+    # re-scored rows gain an entry, every other patient has exactly one, deleted ones left nothing behind
+    assert len(history) == patients
+    assert history[int(rows[5]["id"])] == 2
+    assert history[int(rows[250]["id"])] == 2
+    assert history[999999] == 1
+    assert sum(history.values()) == patients + 2
+
+
+@pytest.mark.parametrize("kind", ["past", "upcoming"])
+@pytest.mark.parametrize("position", [40, 450])  # same chunk as the first copy, later chunk
+def test_repeated_key_is_rejected_with_its_row(client, auth_headers, kind, position):
+    rows = read_rows(DEMO[kind]()[0])
+    user_id = user_id_of(client, auth_headers)
+    assert upload(client, auth_headers, kind, rows, mode="replace").status_code == 200
+    before = stored(kind, user_id)
+
+    repeated = rows[:position] + [dict(rows[30])] + rows[position:]
+    response = upload(client, auth_headers, kind, repeated)
+
+    assert response.status_code == 400
+    detail = response.json()["detail"]
+    assert f"row {position + 2} id" in detail  # line 1 is the header
+    assert f"{rows[30]['id']} @ " in detail and "repeated" in detail
+    assert stored(kind, user_id) == before
+
+    # the failed sync left nothing behind that trips up the next one
+    response = upload(client, auth_headers, kind, edited(kind, rows))
+    assert response.status_code == 200, response.json()
+
+
+@pytest.mark.parametrize("kind", ["past", "upcoming"])
+def test_upsert_removes_duplicates_left_by_replace_uploads(client, auth_headers, kind):
+    rows = read_rows(DEMO[kind]()[0])
+    user_id = user_id_of(client, auth_headers)
+    # replace uploads don't check keys, so a file can store the same appointment twice
+    assert upload(client, auth_headers, kind, rows + [dict(rows[220])], mode="replace").status_code == 200
+    key = (int(rows[220]["id"]), rows[220]["appointment_date"])
+    assert sum(len(copies) for k, copies in stored(kind, user_id).items() if k[0] == key[0]) == 2
+
+    response = upload(client, auth_headers, kind, rows)
+
+    assert response.status_code == 200, response.json()
+    assert response.json()["details"] == {"inserted": 0, "updated": 0, "deleted": 1, "unchanged": len(rows)}
+    after = stored(kind, user_id)
+    assert all(len(copies) == 1 for copies in after.values())
+    assert sum(len(copies) for copies in after.values()) == len(rows)
+    assert_totals_match(daily_totals(kind, user_id), totals_from_rows(kind, after))